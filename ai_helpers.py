@@ -10,12 +10,42 @@ ai_helpers.py - AI推論の共通化・ベストプラクティス
 """
 
 import os
+import re
 import time
+import random
 import json
-from typing import Any, Dict, List, Optional, Callable
+import asyncio
+import hashlib
+import sqlite3
+import string
+import threading
+from collections import OrderedDict, defaultdict
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Any, Dict, List, Optional, Callable, Iterator, Tuple, Union, Literal
 from dataclasses import dataclass
 import google.generativeai as genai
 from google.api_core import exceptions as google_exceptions
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+try:
+    import orjson
+    _json_loads = orjson.loads
+
+    def _json_dumps(obj: Any, indent: bool = False) -> str:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, option=option).decode("utf-8")
+except ImportError:
+    _json_loads = json.loads
+
+    def _json_dumps(obj: Any, indent: bool = False) -> str:
+        return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False)
+
+# 先頭/末尾の Markdown コードフェンス（```json ... ```）
+_FENCE_RE = re.compile(r"\A```(?:json)?\s*|\s*```\Z")
 
 
 # ========================================
@@ -33,6 +63,31 @@ class AIConfig:
     
     # Response format
     response_mime_type: Optional[str] = None  # "application/json" 等
+    
+    # キャッシュ（temperature=0.0 の場合のみ有効）
+    use_cache: bool = True
+    semantic_cache: bool = False  # True: 埋め込み類似度でもヒット判定
+
+
+# ========================================
+# バッチリクエスト
+# ========================================
+
+OutputBin = Literal["s", "m", "l"]
+
+# 出力長ビンごとの同時実行数（max_concurrency に対する倍率）
+BATCH_BIN_CONCURRENCY_SCALE: Dict[str, float] = {
+    "s": 2.0,   # 分類など短い出力
+    "m": 1.0,   # アラームJSONなど中程度
+    "l": 0.5,   # CLIログなど長い出力
+}
+
+
+@dataclass
+class BatchRequest:
+    """出力長ビン付きのバッチ生成リクエスト"""
+    prompt: str
+    bin: OutputBin = "m"
 
 
 # ========================================
@@ -59,6 +114,363 @@ class AITimeoutError(AIError):
     pass
 
 
+# リトライで回復しうるエラー（503/429/500/接続断）
+# これ以外（400/認証エラー等）は即座に失敗させる
+RETRYABLE_ERRORS = (
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.TooManyRequests,
+    ConnectionError,
+    AIResponseError,  # バリデーション失敗
+)
+
+MAX_RETRY_DELAY = 30.0  # 秒
+
+
+def _backoff_delay(base_delay: float, attempt: int) -> float:
+    """指数バックオフ + Full Jitter（並行セッションのリトライ集中を避ける）"""
+    return random.uniform(0, min(base_delay * (2 ** attempt), MAX_RETRY_DELAY))
+
+
+# ========================================
+# レート制限
+# ========================================
+
+DEFAULT_RATE_LIMIT_RPM = 60  # 1分あたりのリクエスト数（AI_RATE_LIMIT_RPM で上書き、0 で無効）
+
+
+class TokenBucket:
+    """
+    トークンバケットによるリクエスト流量制御
+    
+    プロバイダのクォータ未満に送信レートを抑え、429 / DeadlineExceeded と
+    それに伴うリトライを減らす。状態は threading.Lock で保護し、
+    同期・非同期（イベントループを跨いでも）同じ予算を共有する。
+    """
+    
+    def __init__(self, rpm: int = DEFAULT_RATE_LIMIT_RPM):
+        self.capacity = float(rpm)
+        self.rate = rpm / 60.0  # トークン/秒
+        self.tokens = float(rpm)
+        self.last = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def _reserve(self) -> float:
+        """トークンを1つ予約し、送信まで待つべき秒数を返す"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            # 不足分は前借り（負数）として予約し、補充されるまで待たせる
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+    
+    def acquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+    
+    async def acquire_async(self):
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+def _rate_limit_rpm() -> int:
+    try:
+        return max(0, int(os.environ.get("AI_RATE_LIMIT_RPM", DEFAULT_RATE_LIMIT_RPM)))
+    except ValueError:
+        return DEFAULT_RATE_LIMIT_RPM
+
+
+# ========================================
+# レスポンスキャッシュ
+# ========================================
+
+EMBEDDING_MODEL = "models/text-embedding-004"
+
+
+def _embed_with_genai(text: str) -> List[float]:
+    """Gemini Embedding APIでベクトル化"""
+    result = genai.embed_content(model=EMBEDDING_MODEL, content=text)
+    return result["embedding"]
+
+
+class SQLiteLLMCache:
+    """
+    SQLite による永続キャッシュ（LLMCache の L3）
+    
+    プロセス再起動後もレスポンスを再利用する。
+    created_at から ttl 秒を過ぎたエントリは参照しない。
+    類似検索は保存時の設定スコープ（LLMCache.config_scope）が同じ行のみを対象にする。
+    SQLite のエラーはキャッシュミスとして扱い、生成処理は止めない。
+    """
+    
+    def __init__(self, path: str, ttl: float = 7 * 24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, prompt TEXT, response TEXT, embedding BLOB, created_at REAL, scope TEXT)"
+        )
+        # scope 列が無い旧スキーマの DB には列を追加（既存行は NULL = 類似検索の対象外）
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(llm_cache)")}
+        if "scope" not in columns:
+            self._conn.execute("ALTER TABLE llm_cache ADD COLUMN scope TEXT")
+        self._conn.commit()
+        # スコープ別の埋め込み行列（key リスト, 行列）は初回の類似検索でロードし、put で破棄
+        self._matrix: Dict[str, Tuple[List[str], Any]] = {}
+    
+    def _oldest_valid(self) -> float:
+        return time.time() - self.ttl
+    
+    def get(self, key: str) -> Optional[Tuple[str, Any]]:
+        """完全一致検索（レスポンス, 埋め込み）"""
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT response, embedding FROM llm_cache WHERE key = ? AND created_at >= ?",
+                    (key, self._oldest_valid())
+                ).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None:
+            return None
+        embedding = np.frombuffer(row[1], dtype=np.float32) if (row[1] and NUMPY_AVAILABLE) else None
+        return row[0], embedding
+    
+    def search(self, query: Any, threshold: float, scope: str = "") -> Optional[str]:
+        """同じ scope の行の中から、埋め込みのコサイン類似度で検索（query は正規化済み）"""
+        try:
+            with self._lock:
+                if scope not in self._matrix:
+                    rows = self._conn.execute(
+                        "SELECT key, embedding FROM llm_cache "
+                        "WHERE embedding IS NOT NULL AND scope = ? AND created_at >= ?",
+                        (scope, self._oldest_valid())
+                    ).fetchall()
+                    vectors = [np.frombuffer(e, dtype=np.float32) for _, e in rows]
+                    self._matrix[scope] = ([k for k, _ in rows], np.stack(vectors) if vectors else None)
+                keys, matrix = self._matrix[scope]
+                if matrix is None or matrix.shape[1] != query.shape[0]:
+                    return None
+                sims = matrix @ query
+                best = int(np.argmax(sims))
+                if sims[best] < threshold:
+                    return None
+                row = self._conn.execute(
+                    "SELECT response FROM llm_cache WHERE key = ?", (keys[best],)
+                ).fetchone()
+        except sqlite3.Error:
+            return None
+        return row[0] if row else None
+    
+    def put(self, key: str, prompt: str, text: str, embedding: Any = None, scope: str = ""):
+        blob = embedding.astype(np.float32).tobytes() if embedding is not None else None
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, prompt, response, embedding, created_at, scope) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, prompt, text, blob, time.time(), scope)
+                )
+                self._conn.commit()
+                self._matrix.clear()
+        except sqlite3.Error:
+            pass
+    
+    def clear(self):
+        try:
+            with self._lock:
+                self._conn.execute("DELETE FROM llm_cache")
+                self._conn.commit()
+                self._matrix.clear()
+        except sqlite3.Error:
+            pass
+
+
+# 永続キャッシュの保存先（環境変数 AI_CACHE_DB を空にすると無効）
+DEFAULT_CACHE_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".llm_cache.sqlite3")
+
+
+def _open_persistent_cache() -> Optional[SQLiteLLMCache]:
+    path = os.environ.get("AI_CACHE_DB", DEFAULT_CACHE_DB)
+    if not path:
+        return None
+    try:
+        return SQLiteLLMCache(path)
+    except sqlite3.Error:
+        return None
+
+
+class LLMCache:
+    """
+    LLMレスポンスの多層キャッシュ
+    
+    【構成】
+    - L1: (モデル, 温度, MIME, プロンプト) の sha256 完全一致
+    - L2: プロンプト埋め込みのコサイン類似度（閾値以上でヒット。同じ設定のエントリ同士のみ比較）
+    - L3: SQLite 永続キャッシュ（任意、L1/L2 と同じ判定）
+    - L1/L2 は上限超過時に LRU で追い出し
+    """
+    
+    def __init__(
+        self,
+        max_entries: int = 256,
+        similarity_threshold: float = 0.95,
+        embedder: Callable[[str], List[float]] = _embed_with_genai,
+        persistent: Optional[SQLiteLLMCache] = None
+    ):
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.embedder = embedder
+        self.persistent = persistent
+        # key → (レスポンス, 埋め込み, 設定スコープ)
+        self._entries: "OrderedDict[str, Tuple[str, Any, str]]" = OrderedDict()
+        # get() ミス時の埋め込みを put() で再利用（生成失敗で put されない分は古い順に捨てる）
+        self._pending_embeddings: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def make_key(prompt: str, config: AIConfig) -> str:
+        raw = f"{config.model_name}|{config.temperature}|{config.response_mime_type}|{prompt}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    
+    @staticmethod
+    def config_scope(config: AIConfig) -> str:
+        """make_key の設定部分（類似検索はこの値が同じエントリ同士でのみ行う）"""
+        return f"{config.model_name}|{config.temperature}|{config.response_mime_type}"
+    
+    def _embed(self, prompt: str):
+        if not (NUMPY_AVAILABLE and self.embedder):
+            return None
+        try:
+            vec = np.asarray(self.embedder(prompt), dtype=np.float32)
+        except Exception:
+            return None
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else None
+    
+    def get(self, key: str, prompt: str = None, semantic: bool = False, scope: str = "") -> Optional[str]:
+        """
+        L1 → L3(完全一致) → L2 → L3(類似) の順に検索（ミス時は None）
+        
+        scope には config_scope() の値を渡す。類似検索は同じ scope のエントリのみが対象。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry[0]
+        
+        if self.persistent:
+            stored = self.persistent.get(key)
+            if stored is not None:
+                self._remember(key, stored[0], stored[1], scope)
+                return stored[0]
+        
+        if not (semantic and prompt):
+            return None
+        
+        query = self._embed(prompt)
+        if query is None:
+            return None
+        
+        with self._lock:
+            self._pending_embeddings[key] = query
+            self._pending_embeddings.move_to_end(key)
+            while len(self._pending_embeddings) > self.max_entries:
+                self._pending_embeddings.popitem(last=False)
+            keys = [k for k, (_, e, sc) in self._entries.items() if e is not None and sc == scope]
+            if keys:
+                matrix = np.stack([self._entries[k][1] for k in keys])
+                sims = matrix @ query
+                best = int(np.argmax(sims))
+                if sims[best] >= self.similarity_threshold:
+                    self._entries.move_to_end(keys[best])
+                    return self._entries[keys[best]][0]
+        
+        if self.persistent:
+            return self.persistent.search(query, self.similarity_threshold, scope)
+        return None
+    
+    def put(self, key: str, text: str, prompt: str = None, semantic: bool = False, scope: str = ""):
+        """レスポンスを保存（上限超過時は最古のエントリを削除）"""
+        with self._lock:
+            embedding = self._pending_embeddings.pop(key, None)
+        if embedding is None and semantic and prompt:
+            embedding = self._embed(prompt)
+        self._remember(key, text, embedding, scope)
+        if self.persistent:
+            self.persistent.put(key, prompt, text, embedding, scope)
+    
+    def _remember(self, key: str, text: str, embedding: Any, scope: str):
+        with self._lock:
+            self._entries[key] = (text, embedding, scope)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._pending_embeddings.clear()
+        if self.persistent:
+            self.persistent.clear()
+
+
+# ========================================
+# generation_config
+# ========================================
+
+# 既定設定（temperature=0.0）の generation_config は事前構築しておく
+_DEFAULT_GENERATION_CONFIGS: Dict[Optional[str], MappingProxyType] = {
+    None: MappingProxyType({"temperature": 0.0}),
+    "application/json": MappingProxyType({"temperature": 0.0, "response_mime_type": "application/json"}),
+}
+
+
+def _generation_config(temperature: float, response_mime_type: Optional[str]) -> Dict[str, Any]:
+    """generation_config を構築（SDK 側で変更されても良いようにコピーを返す）"""
+    if temperature == 0.0 and response_mime_type in _DEFAULT_GENERATION_CONFIGS:
+        return dict(_DEFAULT_GENERATION_CONFIGS[response_mime_type])
+    
+    generation_config = {
+        "temperature": temperature,
+    }
+    
+    if response_mime_type:
+        generation_config["response_mime_type"] = response_mime_type
+    
+    return generation_config
+
+
+def _response_text(response) -> str:
+    """
+    レスポンス本文を取得
+    
+    response.text は毎回全パートを連結するため、候補のパートを直接参照する。
+    strip は前後に空白がある場合のみ行う。
+    """
+    try:
+        parts = response.candidates[0].content.parts
+    except (AttributeError, IndexError):
+        parts = None
+    if not parts:
+        # ブロック時等は SDK 側の例外（ValueError）に任せる
+        return response.text.strip()
+    
+    text = parts[0].text if len(parts) == 1 else "".join(p.text for p in parts)
+    if text and (text[0].isspace() or text[-1].isspace()):
+        text = text.strip()
+    return text
+
+
 # ========================================
 # AIクライアント（シングルトン）
 # ========================================
@@ -71,6 +483,8 @@ class AIClient:
     - API Key管理の一元化
     - リトライロジックの統一
     - レスポンス検証の標準化
+    - 決定論的（temperature=0.0）な呼び出しのキャッシュ
+    - 同期・非同期で共有するレート制限
     """
     
     _instance: Optional['AIClient'] = None
@@ -84,6 +498,12 @@ class AIClient:
     def __init__(self):
         if not self._configured:
             self._configure()
+            self.cache = LLMCache(persistent=_open_persistent_cache())
+            self._model_cache: Dict[Tuple[str, float, Optional[str]], genai.GenerativeModel] = {}
+            self._model_lock = threading.Lock()
+            self.rate_limiter = TokenBucket(_rate_limit_rpm())
+            # 実行中の非同期リクエスト（cache_key → Future）。同一プロンプトの同時呼び出しを1回にまとめる
+            self._inflight: Dict[str, asyncio.Future] = {}
     
     def _configure(self):
         """API Keyの設定"""
@@ -106,20 +526,25 @@ class AIClient:
         self._configured = True
     
     def create_model(self, config: AIConfig = None) -> genai.GenerativeModel:
-        """モデルインスタンスを作成"""
+        """モデルインスタンスを取得（同一設定のインスタンスは再利用）"""
         config = config or AIConfig()
+        key = (config.model_name, config.temperature, config.response_mime_type)
         
-        generation_config = {
-            "temperature": config.temperature,
-        }
+        # ヒット時はロック不要（dict の参照はアトミック）
+        model = self._model_cache.get(key)
+        if model is not None:
+            return model
         
-        if config.response_mime_type:
-            generation_config["response_mime_type"] = config.response_mime_type
+        with self._model_lock:
+            model = self._model_cache.get(key)
+            if model is None:
+                model = genai.GenerativeModel(
+                    config.model_name,
+                    generation_config=_generation_config(config.temperature, config.response_mime_type)
+                )
+                self._model_cache[key] = model
         
-        return genai.GenerativeModel(
-            config.model_name,
-            generation_config=generation_config
-        )
+        return model
     
     def generate_with_retry(
         self,
@@ -145,11 +570,22 @@ class AIClient:
             AITimeoutError: タイムアウト
         """
         config = config or AIConfig()
+        
+        # キャッシュ参照（決定論的かつ非ストリーミングの場合のみ）
+        cacheable = config.use_cache and config.temperature == 0.0 and not stream
+        if cacheable:
+            cache_key = LLMCache.make_key(prompt, config)
+            cache_scope = LLMCache.config_scope(config)
+            cached = self.cache.get(cache_key, prompt, semantic=config.semantic_cache, scope=cache_scope)
+            if cached is not None:
+                return cached
+        
         model = self.create_model(config)
         
         for attempt in range(config.max_retries):
             try:
-                # 生成実行
+                # 生成実行（リトライも含めて流量制御の対象）
+                self.rate_limiter.acquire()
                 response = model.generate_content(prompt, stream=stream)
                 
                 if stream:
@@ -157,29 +593,166 @@ class AIClient:
                     return response
                 
                 # テキスト取得
-                text = response.text.strip()
+                text = _response_text(response)
                 
                 # バリデーション
                 if validator and not validator(text):
                     raise AIResponseError("Response validation failed")
                 
+                if cacheable:
+                    self.cache.put(cache_key, text, prompt, semantic=config.semantic_cache, scope=cache_scope)
                 return text
             
-            except google_exceptions.ServiceUnavailable:
+            except Exception as e:
+                if isinstance(e, google_exceptions.DeadlineExceeded):
+                    raise AITimeoutError(f"Request timeout after {config.timeout}s")
+                if not isinstance(e, RETRYABLE_ERRORS):
+                    raise AIResponseError(f"AI generation failed: {e}")
                 if attempt == config.max_retries - 1:
-                    raise AIResponseError("Service unavailable after retries")
-                time.sleep(config.retry_delay * (attempt + 1))
-            
-            except google_exceptions.DeadlineExceeded:
-                raise AITimeoutError(f"Request timeout after {config.timeout}s")
+                    raise AIResponseError(f"AI generation failed after {config.max_retries} retries: {e}")
+                time.sleep(_backoff_delay(config.retry_delay, attempt))
+        
+        raise AIResponseError("Max retries reached")
+    
+    async def generate_with_retry_async(
+        self,
+        prompt: str,
+        config: AIConfig = None,
+        validator: Callable[[str], bool] = None,
+        model: genai.GenerativeModel = None
+    ) -> str:
+        """
+        リトライ付きでAI生成（非同期版）
+        
+        generate_with_retry と同じリトライ・キャッシュ規則で
+        generate_content_async を呼び出す。
+        キャッシュ対象のプロンプトが実行中なら、その結果を待って共有する。
+        """
+        config = config or AIConfig()
+        model = model or self.create_model(config)
+        
+        cacheable = config.use_cache and config.temperature == 0.0
+        if not cacheable:
+            return await self._agenerate(prompt, config, validator, model)
+        
+        cache_key = LLMCache.make_key(prompt, config)
+        cache_scope = LLMCache.config_scope(config)
+        cached = self.cache.get(cache_key, prompt, semantic=config.semantic_cache, scope=cache_scope)
+        if cached is not None:
+            return cached
+        
+        loop = asyncio.get_running_loop()
+        inflight = self._inflight.get(cache_key)
+        if inflight is not None and inflight.get_loop() is loop:
+            return await asyncio.shield(inflight)
+        
+        future = loop.create_future()
+        self._inflight[cache_key] = future
+        try:
+            text = await self._agenerate(prompt, config, validator, model)
+            self.cache.put(cache_key, text, prompt, semantic=config.semantic_cache, scope=cache_scope)
+            future.set_result(text)
+            return text
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # 待機者がいない場合の "never retrieved" 警告を抑止
+            raise
+        finally:
+            if self._inflight.get(cache_key) is future:
+                del self._inflight[cache_key]
+    
+    async def _agenerate(
+        self,
+        prompt: str,
+        config: AIConfig,
+        validator: Optional[Callable[[str], bool]],
+        model: genai.GenerativeModel
+    ) -> str:
+        """非同期生成のリトライループ（キャッシュは呼び出し側で扱う）"""
+        for attempt in range(config.max_retries):
+            try:
+                await self.rate_limiter.acquire_async()
+                response = await model.generate_content_async(prompt)
+                text = _response_text(response)
+                
+                if validator and not validator(text):
+                    raise AIResponseError("Response validation failed")
+                
+                return text
             
             except Exception as e:
-                if attempt == config.max_retries - 1:
+                if isinstance(e, google_exceptions.DeadlineExceeded):
+                    raise AITimeoutError(f"Request timeout after {config.timeout}s")
+                if not isinstance(e, RETRYABLE_ERRORS):
                     raise AIResponseError(f"AI generation failed: {e}")
-                time.sleep(config.retry_delay)
+                if attempt == config.max_retries - 1:
+                    raise AIResponseError(f"AI generation failed after {config.max_retries} retries: {e}")
+                await asyncio.sleep(_backoff_delay(config.retry_delay, attempt))
         
         raise AIResponseError("Max retries reached")
     
+    async def batch_generate(
+        self,
+        prompts: List[Union[str, BatchRequest]],
+        config: AIConfig = None,
+        max_concurrency: int = 8
+    ) -> List[str]:
+        """
+        複数プロンプトを並行生成
+        
+        出力長の見込み（BatchRequest.bin）ごとにグルーピングし、
+        ビン単位のセマフォで同時実行数を制御する。
+        短い出力が長い出力の完了待ちで詰まらないようにするため。
+        同一プロンプトは1回だけ送信し、結果を該当する全要素に返す。
+        
+        Args:
+            prompts: プロンプト文字列（ビン "m" 扱い）または BatchRequest
+            max_concurrency: ビン "m" の同時実行数（他ビンは倍率で調整）
+        
+        Returns:
+            prompts と同じ順序の生成テキスト
+        """
+        config = config or AIConfig()
+        model = self.create_model(config)
+        
+        # 重複プロンプトの集約（ビンは最初に現れたリクエストのものを採用）
+        unique: Dict[str, int] = {}
+        idx_map: List[int] = []
+        bins: Dict[str, List[Tuple[int, str]]] = defaultdict(list)
+        for p in prompts:
+            req = p if isinstance(p, BatchRequest) else BatchRequest(p)
+            if req.prompt not in unique:
+                unique[req.prompt] = len(unique)
+                bins[req.bin].append((unique[req.prompt], req.prompt))
+            idx_map.append(unique[req.prompt])
+        
+        results: List[Optional[str]] = [None] * len(unique)
+        
+        async def _run_bin(bin_name: str, items: List[Tuple[int, str]]):
+            scale = BATCH_BIN_CONCURRENCY_SCALE.get(bin_name, 1.0)
+            semaphore = asyncio.Semaphore(max(1, int(max_concurrency * scale)))
+            
+            async def _bounded(i: int, prompt: str):
+                async with semaphore:
+                    results[i] = await self.generate_with_retry_async(prompt, config, model=model)
+            
+            await asyncio.gather(*[_bounded(i, p) for i, p in items])
+        
+        await asyncio.gather(*[_run_bin(b, items) for b, items in bins.items()])
+        return [results[j] for j in idx_map]
+    
+    def batch_generate_sync(
+        self,
+        prompts: List[Union[str, BatchRequest]],
+        config: AIConfig = None,
+        max_concurrency: int = 8
+    ) -> List[str]:
+        """batch_generate の同期ラッパー（Streamlit から呼び出す用）"""
+        return asyncio.run(self.batch_generate(prompts, config, max_concurrency))
+    
     def generate_json(
         self,
         prompt: str,
@@ -201,12 +774,18 @@ class AIClient:
         config.response_mime_type = "application/json"
         
         text = self.generate_with_retry(prompt, config)
-        
+        return self.parse_json(text, schema)
+    
+    @staticmethod
+    def parse_json(text: str, schema: Dict = None) -> Dict:
+        """生成テキストをJSONとしてパース・検証"""
         # Markdownコードブロックの除去
-        text = text.replace("```json", "").replace("```", "").strip()
+        text = text.strip()
+        if text.startswith("```") or text.endswith("```"):
+            text = _FENCE_RE.sub("", text)
         
         try:
-            result = json.loads(text)
+            result = _json_loads(text)
         except json.JSONDecodeError as e:
             raise AIResponseError(f"Invalid JSON response: {e}\nText: {text}")
         
@@ -224,24 +803,51 @@ class AIClient:
 # プロンプトテンプレート管理
 # ========================================
 
+@lru_cache(maxsize=256)
+def _format_template(template: str, items: Tuple[Tuple[str, Any], ...]) -> str:
+    """テンプレート展開（同一の変数セットは再利用）"""
+    return template.format(**dict(items))
+
+
 class PromptTemplate:
     """プロンプトテンプレート"""
     
-    def __init__(self, template: str, required_vars: List[str] = None):
+    def __init__(self, template: str, required_vars: List[str] = None, output_bin: OutputBin = "m"):
         self.template = template
         self.required_vars = required_vars or []
+        self.output_bin = output_bin  # バッチ生成時の出力長ビン
+        
+        # テンプレートのフィールド名は生成時に一度だけ解析
+        self._field_names = tuple(sorted({
+            field_name.split(".", 1)[0].split("[", 1)[0]
+            for _, field_name, _, _ in string.Formatter().parse(template)
+            if field_name
+        }))
+        self._required_set = frozenset(self.required_vars)
     
     def render(self, **kwargs) -> str:
         """変数を埋め込んでプロンプトを生成"""
         # 必須変数チェック
-        missing = [v for v in self.required_vars if v not in kwargs]
+        missing = self._required_set - kwargs.keys()
         if missing:
-            raise ValueError(f"Missing required variables: {missing}")
+            raise ValueError(
+                f"Missing required variables: {[v for v in self.required_vars if v in missing]}"
+            )
         
         try:
-            return self.template.format(**kwargs)
+            items = tuple((name, kwargs[name]) for name in self._field_names)
         except KeyError as e:
             raise ValueError(f"Template variable not provided: {e}")
+        
+        try:
+            return _format_template(self.template, items)
+        except TypeError:
+            # unhashable な値はキャッシュせずに展開
+            return self.template.format(**kwargs)
+    
+    def to_request(self, **kwargs) -> BatchRequest:
+        """展開したプロンプトを出力長ビン付きのバッチリクエストにする"""
+        return BatchRequest(self.render(**kwargs), self.output_bin)
 
 
 # ========================================
@@ -264,7 +870,8 @@ Output Format (JSON only):
   "reasoning": "brief explanation"
 }}
 """,
-    required_vars=["scenario_description", "categories"]
+    required_vars=["scenario_description", "categories"],
+    output_bin="s"
 )
 
 
@@ -290,7 +897,8 @@ Generate CLI output showing these symptoms. Include:
 
 Output raw CLI text only (no markdown, no code blocks).
 """,
-    required_vars=["hostname", "vendor", "os_type", "model", "scenario_description", "symptoms"]
+    required_vars=["hostname", "vendor", "os_type", "model", "scenario_description", "symptoms"],
+    output_bin="l"
 )
 
 
@@ -328,7 +936,8 @@ Output Format (JSON only):
 }}
 """,
     required_vars=["topology_summary", "scenario_name", "scenario_description", 
-                   "impact_scope", "severity", "target_hints"]
+                   "impact_scope", "severity", "target_hints"],
+    output_bin="m"
 )
 
 
@@ -398,6 +1007,54 @@ def generate_mock_log(
     return client.generate_with_retry(prompt, config)
 
 
+def generate_mock_log_stream(
+    hostname: str,
+    vendor: str,
+    os_type: str,
+    model: str,
+    scenario_description: str,
+    symptoms: List[str],
+    config: AIConfig = None
+) -> Iterator[str]:
+    """
+    障害ログをストリーミング生成（チャンク単位でテキストを返す）
+    
+    ストリーム途中で失敗した場合は再生成し、
+    返却済みの部分はスキップして続きから返す。
+    
+    【使用例】
+    st.write_stream(generate_mock_log_stream(...))
+    """
+    client = AIClient()
+    config = config or AIConfig()
+    
+    prompt = LOG_GENERATION_TEMPLATE.render(
+        hostname=hostname,
+        vendor=vendor,
+        os_type=os_type,
+        model=model,
+        scenario_description=scenario_description,
+        symptoms=", ".join(symptoms)
+    )
+    
+    emitted = 0  # 返却済みの文字数
+    for attempt in range(config.max_retries):
+        received = ""
+        try:
+            for chunk in client.generate_with_retry(prompt, config, stream=True):
+                received += chunk.text
+                if len(received) > emitted:
+                    yield received[emitted:]
+                    emitted = len(received)
+            return
+        except AIError:
+            raise
+        except Exception as e:
+            if not isinstance(e, RETRYABLE_ERRORS) or attempt == config.max_retries - 1:
+                raise AIResponseError(f"AI streaming failed: {e}")
+            time.sleep(_backoff_delay(config.retry_delay, attempt))
+
+
 def generate_alarms_ai(
     topology_summary: Dict,
     scenario_name: str,
@@ -422,17 +1079,63 @@ def generate_alarms_ai(
     """
     client = AIClient()
     
-    prompt = ALARM_GENERATION_TEMPLATE.render(
-        topology_summary=json.dumps(topology_summary, indent=2, ensure_ascii=False),
+    prompt = _render_alarm_prompt(
+        _json_dumps(topology_summary, indent=True), scenario_name,
+        scenario_description, impact_scope, severity, target_hints
+    )
+    
+    result = client.generate_json(prompt, config)
+    return result.get("alarms", [])
+
+
+def generate_alarms_ai_batch(
+    topology_summary: Dict,
+    scenarios: List[Dict[str, Any]],
+    config: AIConfig = None,
+    max_concurrency: int = 8
+) -> List[List[Dict[str, Any]]]:
+    """
+    複数シナリオのアラームを並行生成
+    
+    Args:
+        topology_summary: generate_alarms_ai と同じ
+        scenarios: generate_alarms_ai のシナリオ引数
+                   (scenario_name, scenario_description, impact_scope,
+                    severity, target_hints) を持つ辞書のリスト
+    
+    Returns:
+        scenarios と同じ順序のアラームリスト
+    """
+    client = AIClient()
+    config = config or AIConfig()
+    config.response_mime_type = "application/json"
+    
+    # トポロジーのシリアライズはバッチ内で一度だけ
+    topology_json = _json_dumps(topology_summary, indent=True)
+    prompts = [
+        BatchRequest(_render_alarm_prompt(topology_json, **s), ALARM_GENERATION_TEMPLATE.output_bin)
+        for s in scenarios
+    ]
+    texts = client.batch_generate_sync(prompts, config, max_concurrency)
+    return [AIClient.parse_json(t).get("alarms", []) for t in texts]
+
+
+def _render_alarm_prompt(
+    topology_json: str,
+    scenario_name: str,
+    scenario_description: str,
+    impact_scope: str,
+    severity: str,
+    target_hints: Dict
+) -> str:
+    return ALARM_GENERATION_TEMPLATE.render(
+        topology_summary=topology_json,
         scenario_name=scenario_name,
         scenario_description=scenario_description,
         impact_scope=impact_scope,
         severity=severity,
-        target_hints=json.dumps(target_hints, ensure_ascii=False)
+        target_hints=_json_dumps(target_hints)
     )
-    
-    result = client.generate_json(prompt, config)
-    return result.get("alarms", [])
 
 
 # ========================================
@@ -456,7 +1159,7 @@ def with_ai_retry(retries: int = 3, delay: float = 2.0):
                 except (google_exceptions.ServiceUnavailable, AIResponseError) as e:
                     if attempt == retries - 1:
                         raise
-                    time.sleep(delay * (attempt + 1))
+                    time.sleep(_backoff_delay(delay, attempt))
         return wrapper
     return decorator
 
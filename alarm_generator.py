@@ -4,9 +4,102 @@
 各シナリオに応じた適切なアラームを生成する
 """
 
-from typing import List, Dict, Any
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache, partial
+from typing import List, Dict, Any, Optional, Callable, Tuple
 from logic import Alarm, simulate_cascade_failure
 
+
+class TopologyIndex:
+    """
+    トポロジー検索用のインデックス（1パスで構築）
+    
+    タイプ・レイヤー・親子関係をキーにした辞書を持ち、
+    シナリオごとのトポロジー全走査を不要にする。
+    各リストはトポロジーの挿入順を保持する。
+    
+    ノードの形式（NetworkNode 等のオブジェクト / topology.json の dict）は
+    構築時に一度だけ判定し、以降の検索では型判定を行わない。
+    """
+    
+    FIELDS = ("type", "layer", "parent_id")
+    
+    def __init__(self, topology: Dict[str, Any]):
+        sample = next(iter(topology.values()), None)
+        if isinstance(sample, dict):
+            extract = lambda node: tuple(node.get(f) for f in self.FIELDS)
+        else:
+            extract = lambda node: tuple(getattr(node, f, None) for f in self.FIELDS)
+        
+        # 抽出済みフィールド（ノード順の並列リスト）
+        self.ids: List[str] = list(topology)
+        self.types: List[Optional[str]] = []
+        self.layers: List[Any] = []
+        self.parents: List[Optional[str]] = []
+        for node in topology.values():
+            node_type, layer, parent_id = extract(node)
+            self.types.append(None if node_type is None else str(node_type))
+            self.layers.append(layer)
+            self.parents.append(parent_id)
+        
+        self.by_type: Dict[str, List[str]] = {}
+        self.by_layer: Dict[Any, List[str]] = {}
+        self.by_type_layer: Dict[Tuple[str, Any], List[str]] = {}
+        self.layer_of: Dict[str, Any] = {}
+        self.children_of: Dict[str, List[str]] = {}
+        for node_id, node_type, layer, parent_id in zip(self.ids, self.types, self.layers, self.parents):
+            if node_type is not None:
+                self.by_type.setdefault(node_type, []).append(node_id)
+            if layer is not None:
+                self.layer_of[node_id] = layer
+                self.by_layer.setdefault(layer, []).append(node_id)
+                if node_type is not None:
+                    self.by_type_layer.setdefault((node_type, layer), []).append(node_id)
+            if parent_id:
+                self.children_of.setdefault(parent_id, []).append(node_id)
+    
+    def find(self, node_type: str = None, layer: int = None, keyword: str = None) -> Optional[str]:
+        """条件に合う最初のノードIDを返す（keyword は候補リストに対する後段フィルタ）"""
+        if node_type is not None and layer is not None:
+            candidates = self.by_type_layer.get((node_type, layer), [])
+        elif node_type is not None:
+            candidates = self.by_type.get(node_type, [])
+        elif layer is not None:
+            candidates = self.by_layer.get(layer, [])
+        else:
+            candidates = self.ids
+        
+        if not keyword:
+            return candidates[0] if candidates else None
+        return next((node_id for node_id in candidates if keyword in node_id), None)
+
+
+# id(topology) -> (topology, node数, index) の小さなLRU
+# topology 自体を保持するので id の再利用で取り違えることはない
+_INDEX_CACHE: "OrderedDict[int, tuple]" = OrderedDict()
+_INDEX_CACHE_SIZE = 32
+_INDEX_CACHE_LOCK = threading.Lock()
+
+
+def get_topology_index(topology: Dict[str, Any]) -> TopologyIndex:
+    """トポロジーに対応するインデックスを取得（未構築なら構築）"""
+    key = id(topology)
+    with _INDEX_CACHE_LOCK:
+        cached = _INDEX_CACHE.get(key)
+        if cached and cached[0] is topology and cached[1] == len(topology):
+            _INDEX_CACHE.move_to_end(key)
+            return cached[2]
+    
+    idx = TopologyIndex(topology)
+    with _INDEX_CACHE_LOCK:
+        _INDEX_CACHE[key] = (topology, len(topology), idx)
+        if len(_INDEX_CACHE) > _INDEX_CACHE_SIZE:
+            _INDEX_CACHE.popitem(last=False)
+    return idx
+
+
 def generate_alarms_for_scenario(topology: Dict[str, Any], scenario: str) -> List[Alarm]:
     """
     シナリオに応じたアラームを生成する統一関数
@@ -18,46 +111,61 @@ def generate_alarms_for_scenario(topology: Dict[str, Any], scenario: str) -> Lis
     Returns:
         生成されたアラームのリスト
     """
+    return resolve_scenario_handler(scenario)(topology)
+
+
+@lru_cache(maxsize=128)
+def resolve_scenario_handler(scenario: str) -> Callable[[Dict[str, Any]], List[Alarm]]:
+    """
+    シナリオ名 → アラーム生成関数（topology を受け取る）
     
-    # 正常稼働やLive診断の場合は空リスト
-    if "正常" in scenario or "---" in scenario or "[Live]" in scenario:
-        return []
-    
-    # シナリオ別のアラーム生成ロジック
-    if "WAN全回線断" in scenario:
-        return _generate_wan_outage_alarms(topology)
-    
-    elif "FW片系障害" in scenario:
-        return _generate_fw_single_failure_alarms(topology)
-    
-    elif "L2SWサイレント障害" in scenario:
-        return _generate_l2sw_silent_failure_alarms(topology)
-    
-    elif "複合障害" in scenario:
-        return _generate_complex_failure_alarms(topology, scenario)
-    
-    elif "同時多発" in scenario:
-        return _generate_simultaneous_alarms(topology)
+    シナリオ名の解析はシナリオごとに1回だけ行い、
+    以降の呼び出しは辞書参照で生成関数を得る。
+    """
+    # シナリオ別のアラーム生成ロジック（正常稼働やLive診断の場合は空リスト）
+    name = _match_keyword(_SCENARIO_RE, scenario)
+    if name:
+        return partial(SCENARIO_HANDLERS[name], scenario=scenario)
     
     # デバイス特定のシナリオ
-    else:
-        return _generate_device_specific_alarms(topology, scenario)
+    tag = _match_keyword(_DEVICE_TAG_RE, scenario)
+    failure = _match_keyword(_FAILURE_RE, scenario)
+    if not tag or not failure:
+        return _no_alarms
+    return partial(_generate_device_specific_alarms, tag=tag, failure=failure)
+
+
+def _no_alarms(topology: Dict[str, Any]) -> List[Alarm]:
+    return []
+
+
+def _compile_keywords(keywords: Dict[str, str]) -> "re.Pattern":
+    """{グループ名: キーワード} を名前付きグループの正規表現1つにまとめる"""
+    return re.compile("|".join(f"(?P<{name}>{re.escape(k)})" for name, k in keywords.items()))
+
+
+def _match_keyword(pattern: "re.Pattern", text: str) -> Optional[str]:
+    """
+    text を1回走査し、一致したグループ名を返す
+    複数一致した場合は定義順で先のものを優先（従来の if/elif と同じ）
+    """
+    found = [m.lastgroup for m in pattern.finditer(text)]
+    if not found:
+        return None
+    return min(found, key=pattern.groupindex.__getitem__)
 
 
 def _find_node_by_type(topology: Dict, node_type: str, layer: int = None) -> str:
     """ノードタイプでデバイスを検索"""
-    for node_id, node in topology.items():
-        if hasattr(node, 'type') and str(node.type) == node_type:
-            if layer is None or (hasattr(node, 'layer') and node.layer == layer):
-                return node_id
-    return None
+    return get_topology_index(topology).find(node_type=node_type, layer=layer)
 
 
 def _generate_wan_outage_alarms(topology: Dict) -> List[Alarm]:
     """WAN全回線断のアラーム生成"""
     router_id = _find_node_by_type(topology, "ROUTER")
     if router_id:
-        return simulate_cascade_failure(router_id, topology, "Power Supply: Dual Loss (Device Down)")
+        return simulate_cascade_failure(router_id, topology, "Power Supply: Dual Loss (Device Down)",
+                                        children_of=get_topology_index(topology).children_of)
     return []
 
 
@@ -78,11 +186,9 @@ def _generate_l2sw_silent_failure_alarms(topology: Dict) -> List[Alarm]:
     l2sw_id = None
     
     # L2スイッチを探す（複数の命名パターンに対応）
+    idx = get_topology_index(topology)
     for pattern in ["L2_SW_01", "L2_SW_B01", "L2_SW"]:
-        for node_id in topology:
-            if pattern in node_id:
-                l2sw_id = node_id
-                break
+        l2sw_id = idx.find(keyword=pattern)
         if l2sw_id:
             break
     
@@ -92,20 +198,17 @@ def _generate_l2sw_silent_failure_alarms(topology: Dict) -> List[Alarm]:
     
     if l2sw_id and l2sw_id in topology:
         # 配下のAPやデバイスのアラームを生成
-        child_alarms = []
-        for node_id, node in topology.items():
-            if hasattr(node, 'parent_id') and node.parent_id == l2sw_id:
-                child_alarms.append(Alarm(node_id, "Connection Lost", "CRITICAL"))
+        children = idx.children_of.get(l2sw_id, [])
         
-        # 配下が見つからない場合はAPを直接探す
-        if not child_alarms:
-            for node_id, node in topology.items():
-                if hasattr(node, 'type') and "ACCESS_POINT" in str(node.type):
-                    child_alarms.append(Alarm(node_id, "Connection Lost", "CRITICAL"))
-                    if len(child_alarms) >= 4:  # 最大4台まで
-                        break
+        # 配下が見つからない場合はAPを直接探す（最大4台まで）
+        if not children:
+            children = [
+                node_id
+                for node_type, node_ids in idx.by_type.items() if "ACCESS_POINT" in node_type
+                for node_id in node_ids
+            ][:4]
         
-        return child_alarms
+        return [Alarm(node_id, "Connection Lost", "CRITICAL") for node_id in children]
     
     return []
 
@@ -137,67 +240,130 @@ def _generate_simultaneous_alarms(topology: Dict) -> List[Alarm]:
     return alarms
 
 
-def _generate_device_specific_alarms(topology: Dict, scenario: str) -> List[Alarm]:
-    """デバイス固有のシナリオアラーム生成"""
+def _generate_device_specific_alarms(topology: Dict, tag: str, failure: str) -> List[Alarm]:
+    """デバイス固有のシナリオアラーム生成（tag / failure は解析済みのグループ名）"""
     
     # ターゲットデバイスの特定
-    target_id = None
-    
-    if "[WAN]" in scenario:
-        target_id = _find_node_by_type(topology, "ROUTER")
-    elif "[FW]" in scenario:
-        target_id = _find_node_by_type(topology, "FIREWALL")
-    elif "[L2SW]" in scenario:
-        target_id = _find_node_by_type(topology, "SWITCH", layer=4)
-        if not target_id:
-            # L2_SW naming patternを試す
-            for node_id in topology:
-                if "L2_SW" in node_id:
-                    target_id = node_id
-                    break
+    target_id = DEVICE_TARGET_RESOLVERS[tag](topology)
     
     if not target_id:
         return []
     
     # 障害タイプ別のアラーム生成
-    alarms = []
-    
-    if "電源障害：片系" in scenario:
-        alarms = [
-            Alarm(target_id, "Power Supply 1 Failed", "WARNING"),
-            Alarm(target_id, "Redundancy Degraded", "WARNING")
-        ]
-        # FWの場合は追加のHA警告
-        if "[FW]" in scenario:
-            alarms.append(Alarm(target_id, "HA State: Degraded", "WARNING"))
-    
-    elif "電源障害：両系" in scenario:
-        if "[FW]" in scenario:
-            # FWは両系でも冗長があれば少し持ちこたえる可能性
-            alarms = [
-                Alarm(target_id, "Power Supply: Dual Loss", "CRITICAL"),
-                Alarm(target_id, "Device Critical", "CRITICAL")
-            ]
-        else:
-            # 他のデバイスはカスケード障害
-            return simulate_cascade_failure(target_id, topology, "Power Supply: Dual Loss (Device Down)")
-    
-    elif "FAN故障" in scenario:
-        alarms = [
-            Alarm(target_id, "Fan Module Failed", "WARNING"),
-            Alarm(target_id, "Temperature Rising", "WARNING")
-        ]
-    
-    elif "メモリリーク" in scenario:
-        alarms = [
-            Alarm(target_id, "Memory High (85% utilized)", "WARNING"),
-            Alarm(target_id, "Process: bgpd consuming excessive memory", "WARNING")
-        ]
-    
-    elif "BGP" in scenario:
-        alarms = [
-            Alarm(target_id, "BGP Neighbor Down/Up Flapping", "WARNING"),
-            Alarm(target_id, "Routing Table Unstable", "WARNING")
-        ]
-    
+    return FAILURE_HANDLERS[failure](topology, target_id, tag)
+
+
+def _find_l2sw_target(topology: Dict) -> Optional[str]:
+    target_id = _find_node_by_type(topology, "SWITCH", layer=4)
+    if not target_id:
+        # L2_SW naming patternを試す
+        target_id = get_topology_index(topology).find(keyword="L2_SW")
+    return target_id
+
+
+def _psu_single_alarms(topology: Dict, target_id: str, tag: str) -> List[Alarm]:
+    alarms = [
+        Alarm(target_id, "Power Supply 1 Failed", "WARNING"),
+        Alarm(target_id, "Redundancy Degraded", "WARNING")
+    ]
+    # FWの場合は追加のHA警告
+    if tag == "fw":
+        alarms.append(Alarm(target_id, "HA State: Degraded", "WARNING"))
     return alarms
+
+
+def _psu_dual_alarms(topology: Dict, target_id: str, tag: str) -> List[Alarm]:
+    if tag == "fw":
+        # FWは両系でも冗長があれば少し持ちこたえる可能性
+        return [
+            Alarm(target_id, "Power Supply: Dual Loss", "CRITICAL"),
+            Alarm(target_id, "Device Critical", "CRITICAL")
+        ]
+    # 他のデバイスはカスケード障害
+    return simulate_cascade_failure(target_id, topology, "Power Supply: Dual Loss (Device Down)",
+                                    children_of=get_topology_index(topology).children_of)
+
+
+def _fan_alarms(topology: Dict, target_id: str, tag: str) -> List[Alarm]:
+    return [
+        Alarm(target_id, "Fan Module Failed", "WARNING"),
+        Alarm(target_id, "Temperature Rising", "WARNING")
+    ]
+
+
+def _memory_alarms(topology: Dict, target_id: str, tag: str) -> List[Alarm]:
+    return [
+        Alarm(target_id, "Memory High (85% utilized)", "WARNING"),
+        Alarm(target_id, "Process: bgpd consuming excessive memory", "WARNING")
+    ]
+
+
+def _bgp_alarms(topology: Dict, target_id: str, tag: str) -> List[Alarm]:
+    return [
+        Alarm(target_id, "BGP Neighbor Down/Up Flapping", "WARNING"),
+        Alarm(target_id, "Routing Table Unstable", "WARNING")
+    ]
+
+
+# ========================================
+# シナリオ → アラーム生成関数の対応表
+# ========================================
+# キーワードは定義順が優先順位（シナリオ名が複数を含む場合は先のものを採用）
+
+# 広域・特殊シナリオ
+SCENARIO_KEYWORDS: Dict[str, str] = {
+    "normal": "正常",
+    "separator": "---",
+    "live": "[Live]",
+    "wan_outage": "WAN全回線断",
+    "fw_single": "FW片系障害",
+    "l2sw_silent": "L2SWサイレント障害",
+    "complex": "複合障害",
+    "simultaneous": "同時多発",
+}
+
+SCENARIO_HANDLERS: Dict[str, Callable[[Dict, str], List[Alarm]]] = {
+    "normal": lambda topology, scenario: [],
+    "separator": lambda topology, scenario: [],
+    "live": lambda topology, scenario: [],
+    "wan_outage": lambda topology, scenario: _generate_wan_outage_alarms(topology),
+    "fw_single": lambda topology, scenario: _generate_fw_single_failure_alarms(topology),
+    "l2sw_silent": lambda topology, scenario: _generate_l2sw_silent_failure_alarms(topology),
+    "complex": _generate_complex_failure_alarms,
+    "simultaneous": lambda topology, scenario: _generate_simultaneous_alarms(topology),
+}
+
+# デバイス固有シナリオ: 対象デバイスのタグ
+DEVICE_TAGS: Dict[str, str] = {
+    "wan": "[WAN]",
+    "fw": "[FW]",
+    "l2sw": "[L2SW]",
+}
+
+DEVICE_TARGET_RESOLVERS: Dict[str, Callable[[Dict], Optional[str]]] = {
+    "wan": lambda topology: _find_node_by_type(topology, "ROUTER"),
+    "fw": lambda topology: _find_node_by_type(topology, "FIREWALL"),
+    "l2sw": _find_l2sw_target,
+}
+
+# デバイス固有シナリオ: 障害タイプ
+FAILURE_KEYWORDS: Dict[str, str] = {
+    "psu_single": "電源障害：片系",
+    "psu_dual": "電源障害：両系",
+    "fan": "FAN故障",
+    "memory": "メモリリーク",
+    "bgp": "BGP",
+}
+
+FAILURE_HANDLERS: Dict[str, Callable[[Dict, str, str], List[Alarm]]] = {
+    "psu_single": _psu_single_alarms,
+    "psu_dual": _psu_dual_alarms,
+    "fan": _fan_alarms,
+    "memory": _memory_alarms,
+    "bgp": _bgp_alarms,
+}
+
+# 各キーワード群を1つの正規表現にまとめ、シナリオ名を1回の走査で判定する
+_SCENARIO_RE = _compile_keywords(SCENARIO_KEYWORDS)
+_DEVICE_TAG_RE = _compile_keywords(DEVICE_TAGS)
+_FAILURE_RE = _compile_keywords(FAILURE_KEYWORDS)
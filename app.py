@@ -1,11 +1,11 @@
 import streamlit as st
-import graphviz
 import os
 import time
 import google.generativeai as genai
 import json
 import re
 import pandas as pd
+import numpy as np
 from google.api_core import exceptions as google_exceptions
 try:
     import plotly.graph_objects as go
@@ -15,6 +15,11 @@ except ImportError:
     PLOTLY_AVAILABLE = False
     print("⚠️ Plotly not installed. Some visualizations will be limited.")
 from datetime import datetime, timedelta
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+import heapq
 import math
 
 # モジュール群のインポート
@@ -24,17 +29,19 @@ from logic import CausalInferenceEngine, Alarm, simulate_cascade_failure
 from registry import (
     list_tenants,
     list_networks,
+    list_scopes,
     get_paths,
-    load_topology,
+    load_topology_cached,
     topology_mtime,
+    SCOPE_SCAN_TTL,
 )
-from network_ops import run_diagnostic_simulation, generate_remediation_commands, predict_initial_symptoms, generate_fake_log_by_ai
+from network_ops import run_diagnostic_simulation, generate_remediation_commands, predict_initial_symptoms, generate_fake_log_by_ai, generate_fake_log_by_ai_stream, sanitize_stream, uses_ai_generated_log, build_model_for_key, api_key_hash, LogGenerationError
 from verifier import verify_log_content, format_verification_report
-from inference_engine import LogicalRCA
+from inference_engine import LogicalRCA, LLM_PENDING, LLM_ERROR
 
 # 🆕 アラーム生成ロジック
 try:
-    from alarm_generator import generate_alarms_for_scenario
+    from alarm_generator import generate_alarms_for_scenario, get_topology_index
     ALARM_GENERATOR_AVAILABLE = True
 except ImportError:
     ALARM_GENERATOR_AVAILABLE = False
@@ -79,34 +86,56 @@ SCENARIO_IMPACT_MAP = {
     "正常稼働": 0,
 }
 
+# SCENARIO_IMPACT_MAP のキーを定義順の1つの正規表現に（先読みで全位置を走査し、重なるキーも取りこぼさない）
+_SCENARIO_IMPACT_RANK = {k: i for i, k in enumerate(SCENARIO_IMPACT_MAP)}
+_SCENARIO_IMPACT_RE = re.compile("(?=(" + "|".join(re.escape(k) for k in SCENARIO_IMPACT_MAP) + "))")
+
+@lru_cache(maxsize=64)
 def _get_scenario_impact_level(selected_scenario: str) -> int:
     if selected_scenario in SCENARIO_IMPACT_MAP:
         return SCENARIO_IMPACT_MAP[selected_scenario]
-    for key, value in SCENARIO_IMPACT_MAP.items():
-        if key in selected_scenario:
-            return value
+    # 含まれるキーのうち定義順で最初のもの（従来の線形走査と同じ優先順位）
+    hits = [m.group(1) for m in _SCENARIO_IMPACT_RE.finditer(selected_scenario)]
+    if hits:
+        return SCENARIO_IMPACT_MAP[min(hits, key=_SCENARIO_IMPACT_RANK.__getitem__)]
     return ImpactLevel.DEGRADED_MID
 
+@dataclass(frozen=True)
+class ScenarioKey:
+    """シナリオ名の解析結果（部分文字列の判定はここで1回だけ行い、以降は属性で分岐する）"""
+    label: str
+    impact: int
+    quiet: bool   # トポロジに依らずアラーム0件（正常稼働・区切り）
+    silent: bool  # サイレント障害系
+    normal: bool  # 正常稼働そのもの（AI呼び出しを省く）
+
+@lru_cache(maxsize=64)
+def parse_scenario(selected_scenario: str) -> ScenarioKey:
+    return ScenarioKey(
+        label=selected_scenario,
+        impact=_get_scenario_impact_level(selected_scenario),
+        quiet="正常" in selected_scenario or "---" in selected_scenario,
+        silent="サイレント" in selected_scenario,
+        normal=selected_scenario == "正常稼働",
+    )
+
 # =====================================================
 # Multi-tenant helpers
 # =====================================================
+@lru_cache(maxsize=256)
 def display_company(tenant_id: str) -> str:
     if tenant_id.endswith("社"):
         return tenant_id
     return f"{tenant_id}社"
 
-def _node_type(node) -> str:
-    try: return str(getattr(node, "type", "UNKNOWN"))
-    except Exception: return "UNKNOWN"
-
-def _node_layer(node) -> int:
-    try: return int(getattr(node, "layer", 999))
-    except Exception: return 999
-
 def _find_target_node_id(topology: dict, node_type: str | None = None, layer: int | None = None, keyword: str | None = None) -> str | None:
+    # タイプ/レイヤー別インデックス（トポロジーごとに1回構築）で候補を絞る
+    if ALARM_GENERATOR_AVAILABLE:
+        return get_topology_index(topology).find(node_type or None, layer, keyword)
     for node_id, node in topology.items():
-        if node_type and _node_type(node) != node_type: continue
-        if layer is not None and _node_layer(node) != layer: continue
+        # NetworkNode の type / layer は構築時に str / int へ正規化済み
+        if node_type and node.type != node_type: continue
+        if layer is not None and node.layer != layer: continue
         if keyword and keyword not in str(node_id): continue
         return node_id
     return None
@@ -116,47 +145,63 @@ def _make_alarms(topology: dict, selected_scenario: str):
         return generate_alarms_for_scenario(topology, selected_scenario)
     return _make_alarms_legacy(topology, selected_scenario)
 
+# レガシー判定で使うキーワード（シナリオ名ごとに1回だけ判定して集合で保持）
+_LEGACY_TOKENS = ("---", "正常", "Live", "FW片系障害", "WAN", "FW", "L2SW", "電源", "片系", "FAN", "メモリ", "BGP")
+
+@dataclass(frozen=True)
+class AlarmSpec:
+    """レガシー生成のアラーム定義: 対象ノードの条件と (message, severity) の並び"""
+    node_type: str
+    layer: int | None
+    alarms: tuple
+
+# FW片系障害（対象が見つからなければ以降の判定へ進む）
+_LEGACY_FW_HALF_SPEC = AlarmSpec("FIREWALL", None, (("Heartbeat Loss", "WARNING"), ("HA State: Degraded", "WARNING")))
+
+# 対象デバイス（定義順で最初に含まれるタグを採用）
+_LEGACY_TARGETS = (
+    ("WAN", "ROUTER", None),
+    ("FW", "FIREWALL", None),
+    ("L2SW", "SWITCH", 4),
+)
+
+# 障害タイプ（すべてのキーワードを含む最初の定義を採用）
+_LEGACY_FAILURES = (
+    (("電源", "片系"), (("Power Supply 1 Failed", "WARNING"),)),
+    (("電源",), (("Power Supply: Dual Loss", "CRITICAL"),)),
+    (("FAN",), (("Fan Fail", "WARNING"),)),
+    (("メモリ",), (("Memory High", "WARNING"),)),
+    (("BGP",), (("BGP Flapping", "WARNING"),)),
+)
+
+@lru_cache(maxsize=128)
+def _legacy_alarm_specs(selected_scenario: str) -> tuple:
+    """シナリオ名 → 試行する AlarmSpec の並び（シナリオごとに1回だけ解決）"""
+    tokens = frozenset(t for t in _LEGACY_TOKENS if t in selected_scenario)
+    if "---" in tokens or "正常" in tokens or "Live" in tokens:
+        return ()
+
+    specs = []
+    if "FW片系障害" in tokens:
+        specs.append(_LEGACY_FW_HALF_SPEC)
+    target = next(((t, l) for tag, t, l in _LEGACY_TARGETS if tag in tokens), None)
+    failure = next((alarms for required, alarms in _LEGACY_FAILURES if all(k in tokens for k in required)), None)
+    if target and failure:
+        specs.append(AlarmSpec(target[0], target[1], failure))
+    return tuple(specs)
+
 def _make_alarms_legacy(topology: dict, selected_scenario: str):
-    if "---" in selected_scenario or "正常" in selected_scenario: return []
-    if "Live" in selected_scenario or "[Live]" in selected_scenario: return []
-    
-    alarms = []
-    target_device_id = None
-    
-    # FW片系障害の処理
-    if "FW片系障害" in selected_scenario:
-        fid = _find_target_node_id(topology, node_type="FIREWALL")
-        if fid:
-            return [Alarm(fid, "Heartbeat Loss", "WARNING"), 
-                    Alarm(fid, "HA State: Degraded", "WARNING")]
-    
-    if "[WAN]" in selected_scenario or "WAN" in selected_scenario:
-        target_device_id = _find_target_node_id(topology, node_type="ROUTER")
-    elif "[FW]" in selected_scenario or "FW" in selected_scenario:
-        target_device_id = _find_target_node_id(topology, node_type="FIREWALL")
-    elif "[L2SW]" in selected_scenario or "L2SW" in selected_scenario:
-        target_device_id = _find_target_node_id(topology, node_type="SWITCH", layer=4)
-    
-    if target_device_id:
-        if "電源" in selected_scenario:
-            if "片系" in selected_scenario:
-                alarms.append(Alarm(target_device_id, "Power Supply 1 Failed", "WARNING"))
-            else:
-                alarms.append(Alarm(target_device_id, "Power Supply: Dual Loss", "CRITICAL"))
-        elif "FAN" in selected_scenario:
-            alarms.append(Alarm(target_device_id, "Fan Fail", "WARNING"))
-        elif "メモリ" in selected_scenario:
-            alarms.append(Alarm(target_device_id, "Memory High", "WARNING"))
-        elif "BGP" in selected_scenario:
-            alarms.append(Alarm(target_device_id, "BGP Flapping", "WARNING"))
-            
-    return alarms
+    for spec in _legacy_alarm_specs(selected_scenario):
+        target_id = _find_target_node_id(topology, node_type=spec.node_type, layer=spec.layer)
+        if target_id:
+            return [Alarm(target_id, message, severity) for message, severity in spec.alarms]
+    return []
 
-def _status_from_alarms(selected_scenario: str, alarms) -> str:
+def _status_from_alarms(scenario: ScenarioKey, alarms) -> str:
     """改良版：影響度ベースでステータスを決定"""
     if not alarms: return "正常"
     
-    impact_level = _get_scenario_impact_level(selected_scenario)
+    impact_level = scenario.impact
     
     # 完全停止
     if impact_level >= ImpactLevel.COMPLETE_OUTAGE: 
@@ -168,9 +213,9 @@ def _status_from_alarms(selected_scenario: str, alarms) -> str:
     
     # 中程度の冗長性喪失
     elif impact_level >= ImpactLevel.DEGRADED_MID:
-        severities = [str(getattr(a, "severity", "")).upper() for a in alarms]
         # CRITICALアラームがある場合は「要対応」に格上げ
-        if any(s == "CRITICAL" for s in severities): 
+        # （Alarm の severity は生成時に大文字の定数へ正規化済みなので、そのまま比較して最初の一致で打ち切る）
+        if any(a.severity == "CRITICAL" for a in alarms): 
             return "要対応"
         return "注意"
     
@@ -181,87 +226,237 @@ def _status_from_alarms(selected_scenario: str, alarms) -> str:
     else: 
         return "正常"
 
+@dataclass(frozen=True)
+class ScopeState:
+    """1スコープ×シナリオの計算結果（全社ビューとコックピットで共有）"""
+    topology: dict
+    alarms: tuple
+    status: str
+    alarm_ids: frozenset  # アラーム発生デバイスID（描画側で再計算しない）
+
+@lru_cache(maxsize=1024)
+def _scope_state(topology_path, mtime: float, selected_scenario: str) -> ScopeState:
+    # トポロジ読込はシナリオ非依存のキャッシュ（load_topology_cached）を共有し、
+    # シナリオ切替時はアラーム生成とステータス判定だけを再実行する
+    try:
+        topo = load_topology_cached(topology_path)
+    except:
+        topo = {}
+
+    alarms = tuple(_make_alarms(topo, selected_scenario))
+    return ScopeState(topo, alarms, _status_from_alarms(parse_scenario(selected_scenario), alarms), frozenset(a.device_id for a in alarms))
+
+def _summarize_scope(tenant_id: str, network_id: str, mtime: float, selected_scenario: str) -> tuple[int, str]:
+    """1スコープ分のアラーム数とステータス（st.session_state に触れないのでワーカースレッドから呼べる）"""
+    paths = get_paths(tenant_id, network_id)
+    state = _scope_state(paths.topology_path, mtime, selected_scenario)
+    return len(state.alarms), state.status
+
+SCOPE_POOL_WORKERS = 16
+
+@st.cache_resource(show_spinner=False)
+def _scope_pool() -> ThreadPoolExecutor:
+    """スコープ単位の I/O（stat・トポロジ読込）用の共有スレッドプール（再実行ごとにスレッドを起こさない）"""
+    return ThreadPoolExecutor(max_workers=SCOPE_POOL_WORKERS, thread_name_prefix="scope")
+
+@st.cache_data(persist="disk", show_spinner=False)
+def _summarize_scopes(scope_keys: tuple, selected_scenario: str) -> list[tuple[int, str]]:
+    """
+    全スコープのサマリ（scope_keys は (tenant, network, topology mtime) のタプル）
+    ディスクに永続化し、ワーカー再起動後も再計算しない。mtime がキーに含まれるので TTL は不要
+    """
+    # トポロジ読込（I/O）をスコープ間で並列化
+    return list(_scope_pool().map(lambda k: _summarize_scope(*k, selected_scenario), scope_keys))
+
+COMPANY_ROW_COLUMNS = ["tenant", "network", "company_network", "status", "alarm_count", "delta", "maintenance", "mttr", "priority"]
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _company_rows(selected_scenario: str, scope_keys: tuple, maint_tenants: frozenset) -> list[dict]:
+    """
+    全社ボードの行（delta 以外）。st.session_state に依存せず、
+    シナリオ・各トポロジの mtime・メンテナンス対象が変わらない限りキャッシュを返す
+    """
+    if parse_scenario(selected_scenario).quiet:
+        # 正常稼働はファイルに触れずに返す
+        summaries = [(0, "正常")] * len(scope_keys)
+    else:
+        summaries = _summarize_scopes(scope_keys, selected_scenario)
+
+    # 列単位で組み立て、派生列は pandas の列演算で求める
+    df = pd.DataFrame({
+        "tenant": [k[0] for k in scope_keys],
+        "network": [k[1] for k in scope_keys],
+        "status": [status for _, status in summaries],
+        "alarm_count": [count for count, _ in summaries],
+    })
+    df["company_network"] = df["tenant"].map(display_company) + " / " + df["network"]
+    df["delta"] = None
+    df["maintenance"] = df["tenant"].isin(list(maint_tenants))
+    # MTTR計算（モック）
+    needs_action = df["status"].isin(["停止", "要対応"])
+    df["mttr"] = (30 + df["alarm_count"] * 5).astype(str).add("分").where(needs_action, "-")
+    df["priority"] = df["status"].map({"停止": 1, "要対応": 2}).fillna(3).astype(int)
+    return df[COMPANY_ROW_COLUMNS].to_dict("records")
+
+@st.cache_data(ttl=SCOPE_SCAN_TTL, show_spinner=False)
+def _scope_keys(with_mtime: bool) -> tuple:
+    """
+    (tenant, network, topology mtime) の一覧
+    スコープ一覧と同じ TTL でキャッシュし、ボタン・スライダー操作ごとの全スコープ stat を省く
+    """
+    try:
+        all_scopes = list(list_scopes())
+    except:
+        all_scopes = [get_paths("A", "default"), get_paths("B", "default")]
+
+    if not with_mtime:
+        return tuple((p.tenant_id, p.network_id, 0.0) for p in all_scopes)
+    # stat もスコープ間で並列化（ネットワークストレージ上で効く）
+    mtimes = _scope_pool().map(lambda p: topology_mtime(p.topology_path), all_scopes)
+    return tuple((p.tenant_id, p.network_id, m) for p, m in zip(all_scopes, mtimes))
+
 def _build_company_rows(selected_scenario: str):
     maint_flags = st.session_state.get("maint_flags", {}) or {}
     prev = st.session_state.get("prev_company_snapshot", {}) or {}
-    rows = []
-    
-    all_scopes = []
-    try:
-        for t in list_tenants():
-            for n in list_networks(t):
-                all_scopes.append((t, n))
-    except:
-        all_scopes = [("A", "default"), ("B", "default")]
 
-    for tenant_id, network_id in all_scopes:
-        try:
-            paths = get_paths(tenant_id, network_id)
-            topo = load_topology(paths.topology_path)
-        except:
-            topo = {}
-
-        alarms = _make_alarms(topo, selected_scenario)
-        alarm_count = len(alarms)
-        status = _status_from_alarms(selected_scenario, alarms)
-        is_maint = bool(maint_flags.get(tenant_id, False))
-
-        key = f"{tenant_id}/{network_id}"
-        prev_count = prev.get(key, {}).get("alarm_count")
-        delta = None if prev_count is None else (alarm_count - prev_count)
-
-        # MTTR計算（モック）
-        if status in ["停止", "要対応"]:
-            mttr = f"{30 + alarm_count * 5}分"
-        else:
-            mttr = "-"
-
-        rows.append({
-            "tenant": tenant_id,
-            "network": network_id,
-            "company_network": f"{display_company(tenant_id)} / {network_id}",
-            "status": status,
-            "alarm_count": alarm_count,
-            "delta": delta,
-            "maintenance": is_maint,
-            "mttr": mttr,
-            "priority": 1 if status == "停止" else (2 if status == "要対応" else 3),
-        })
+    # 正常稼働は結果がトポロジに依存しないので mtime の取得も省く
+    scope_keys = _scope_keys(not parse_scenario(selected_scenario).quiet)
+    maint_tenants = frozenset(t for t, on in maint_flags.items() if on)
+
+    rows = _company_rows(selected_scenario, scope_keys, maint_tenants)
+
+    # 前回スナップショットとの差分はセッションごとに付与
+    for r in rows:
+        prev_count = prev.get(f'{r["tenant"]}/{r["network"]}', {}).get("alarm_count")
+        r["delta"] = None if prev_count is None else (r["alarm_count"] - prev_count)
 
     st.session_state.prev_company_snapshot = {
         f'{r["tenant"]}/{r["network"]}': {"alarm_count": r["alarm_count"]} for r in rows
     }
     return rows
 
+# トリアージ一覧の既定表示件数
+TRIAGE_MAX_ROWS = 50
+
+def _triage_severity(r: dict) -> int:
+    """トリアージ表の深刻度（%）: ステータスとアラーム数から算出"""
+    if r['status'] == "停止":
+        return 100
+    if r['status'] == "要対応":
+        # アラーム数に応じて70-95%の範囲で変動
+        return min(95, 70 + r['alarm_count'] * 2)
+    if r['status'] == "注意":
+        # アラーム数に応じて30-60%の範囲で変動
+        return min(60, 30 + r['alarm_count'] * 3)
+    return max(5, r['alarm_count'] * 2)  # 正常でも少し表示
+
 # =====================================================
 # 改良版プロフェッショナルダッシュボード
 # =====================================================
+# 全体健全性インジケーター（再実行ごとに f-string を組み立てないよう定数テンプレートに）
+_HEALTH_BAR_HTML = """
+<div style="text-align: center; margin-bottom: 10px;">
+    <span style="font-size: 14px; color: #666;">全体健全性</span>
+    <div style="
+        display: inline-block;
+        margin-left: 10px;
+        background: linear-gradient(to right, #e0e0e0, #f5f5f5);
+        border-radius: 20px;
+        width: 200px;
+        height: 8px;
+        position: relative;
+    ">
+        <div style="
+            width: {health}%;
+            height: 100%;
+            background: {color};
+            border-radius: 20px;
+        "></div>
+    </div>
+    <span style="
+        margin-left: 10px;
+        font-weight: bold;
+        color: {color};
+    ">{health:.0f}%</span>
+</div>
+"""
+
+def _select_scope(tenant_id: str, network_id: str, auto_remediate: bool = False):
+    """
+    コックピットの対象スコープを切り替える（ボタンの on_click から呼ぶ）
+    コールバックは再実行の前に走るので、st.rerun() による2回目の全体実行が不要になる。
+    URL のクエリパラメータにも残し、リロード・共有時に同じスコープを開く
+    """
+    st.session_state.selected_scope = {"tenant": tenant_id, "network": network_id}
+    st.query_params.update({"t": tenant_id, "n": network_id})
+    if auto_remediate:
+        st.session_state.auto_remediate = True
+
+# ヒートマップの配色（色値 0〜100）と凡例の代表色
+HEATMAP_COLORSCALE = [
+    [0, '#2e7d32'],      # 濃い緑（健全）
+    [0.3, '#66bb6a'],    # 緑
+    [0.5, '#fdd835'],    # 黄
+    [0.7, '#ff9800'],    # オレンジ
+    [0.85, '#f44336'],   # 赤
+    [1, '#b71c1c']       # 濃い赤（危機的）
+]
+HEATMAP_LEGEND_COLORS = {"停止": '#b71c1c', "要対応": '#ff9800', "注意": '#fdd835', "正常": '#2e7d32'}
+
+# KPI カード（4枚を1つの要素として送る）
+# スタイルはクラスに集約し、カードごとのインライン style を持たない
+_KPI_CSS = (
+    "<style>"
+    ".kpi-row{display:flex;gap:16px}"
+    ".kpi-card{flex:1;padding:8px 12px}"
+    ".kpi-label{font-size:14px;color:#666}"
+    ".kpi-value{font-size:2.25rem;line-height:1.3}"
+    "</style>"
+)
+_KPI_CARD_HTML = (
+    '<div class="kpi-card" title="{help}">'
+    '<div class="kpi-label">{label}</div><div class="kpi-value">{value}社</div>'
+    '</div>'
+)
+
+@lru_cache(maxsize=256)
+def _kpi_cards_html(count_stop: int, count_action: int, count_warn: int, count_normal: int) -> str:
+    cards = (
+        ("🔴 障害発生", count_stop, "サービス停止レベル"),
+        ("🟠 要対応", count_action, "冗長性喪失・ハザーダス状態"),
+        ("🟡 注意", count_warn, "軽微なアラート"),
+        ("🟢 正常", count_normal, "アラートなし"),
+    )
+    body = "".join(_KPI_CARD_HTML.format(label=label, value=value, help=help_text) for label, value, help_text in cards)
+    return f'{_KPI_CSS}<div class="kpi-row">{body}</div>'
+
 def _render_all_companies_board(selected_scenario: str, df_height: int = 220):
     """
     完全改良版: ダイナミックビジュアルとプロフェッショナルUI
     """
     rows = _build_company_rows(selected_scenario)
     
-    # 集計
-    df_rows = pd.DataFrame(rows)
-    count_stop = len(df_rows[df_rows['status'] == '停止'])
-    count_action = len(df_rows[df_rows['status'] == '要対応'])
-    count_warn = len(df_rows[df_rows['status'] == '注意'])
-    count_normal = len(df_rows[df_rows['status'] == '正常'])
+    # 集計（ステータス別件数とアラーム数の合計・最大を1パスで求める）
+    status_counts = Counter()
+    total_alarms = 0
+    max_alarms = 0
+    for r in rows:
+        status_counts[r['status']] += 1
+        total_alarms += r['alarm_count']
+        if r['alarm_count'] > max_alarms:
+            max_alarms = r['alarm_count']
+    count_stop = status_counts['停止']
+    count_action = status_counts['要対応']
+    count_warn = status_counts['注意']
+    count_normal = status_counts['正常']
     
-    # アラーム数の集計（エラー修正用）
-    alarm_counts = [r['alarm_count'] for r in rows]
-    total_alarms = sum(alarm_counts)
-    max_alarms = max(alarm_counts) if alarm_counts else 0
+    # 行の列表現はここで1回だけ作り、ヒートマップとトリアージのフィルタで共有する
+    df_rows = pd.DataFrame(rows, columns=COMPANY_ROW_COLUMNS)
 
     st.subheader("🏢 全社状態ボード")
 
     # 1. KPI メトリクス
-    kpi1, kpi2, kpi3, kpi4 = st.columns(4)
-    kpi1.metric("🔴 障害発生", f"{count_stop}社", help="サービス停止レベル")
-    kpi2.metric("🟠 要対応", f"{count_action}社", help="冗長性喪失・ハザーダス状態")
-    kpi3.metric("🟡 注意", f"{count_warn}社", help="軽微なアラート")
-    kpi4.metric("🟢 正常", f"{count_normal}社", help="アラートなし")
+    st.markdown(_kpi_cards_html(count_stop, count_action, count_warn, count_normal), unsafe_allow_html=True)
     
     st.divider()
 
@@ -284,74 +479,41 @@ def _render_all_companies_board(selected_scenario: str, df_height: int = 220):
                         r = rows[i + j]
                         with col:
                             color = {"停止": "🔴", "要対応": "🟠", "注意": "🟡", "正常": "🟢"}[r['status']]
-                            if st.button(
+                            st.button(
                                 f"{color} {r['company_network']}\n{r['alarm_count']}件",
                                 key=f"heat_{r['tenant']}_{r['network']}",
-                                use_container_width=True
-                            ):
-                                st.session_state.selected_scope = {"tenant": r['tenant'], "network": r['network']}
-                                st.rerun()
+                                use_container_width=True,
+                                on_click=_select_scope, args=(r['tenant'], r['network'])
+                            )
         else:
             # Plotlyバブルチャート（改良版）
-            data_for_plot = []
-            
             # 全体の健全性スコアを計算
-            total_critical = sum(1 for r in rows if r['status'] == '停止')
-            total_warning = sum(1 for r in rows if r['status'] == '要対応')
+            total_critical = count_stop
+            total_warning = count_action
             overall_health = 100 - (total_critical * 30 + total_warning * 15)  # 健全性スコア
             
-            for r in rows:
+            # 行ごとのループではなく列演算で組み立てる
+            status = df_rows['status'].to_numpy()
+            alarm_ratio = df_rows['alarm_count'].to_numpy(dtype=float) / max(max_alarms, 1)
+            df_plot = pd.DataFrame({
+                "会社": df_rows['company_network'],
+                "アラーム数": df_rows['alarm_count'],
+                "ステータス": df_rows['status'],
                 # ステータスに基づく色の値（健全性を反映）
-                if r['status'] == "停止":
-                    color_value = 100
-                elif r['status'] == "要対応":
-                    color_value = 70 + (r['alarm_count'] / max(max_alarms, 1)) * 10
-                elif r['status'] == "注意":
-                    color_value = 30 + (r['alarm_count'] / max(max_alarms, 1)) * 20
-                else:
-                    color_value = 5
-                
-                data_for_plot.append({
-                    "会社": r['company_network'],
-                    "アラーム数": r['alarm_count'],
-                    "ステータス": r['status'],
-                    "色値": color_value,
-                    "tenant": r['tenant'],
-                    "network": r['network'],
-                    "表示テキスト": f"{r['company_network']}<br>{r['alarm_count']}件",
-                    "メンテナンス": "🛠️" if r['maintenance'] else ""
-                })
-            
-            df_plot = pd.DataFrame(data_for_plot)
+                "色値": np.select(
+                    [status == "停止", status == "要対応", status == "注意"],
+                    [100, 70 + alarm_ratio * 10, 30 + alarm_ratio * 20],
+                    default=5,
+                ),
+                "tenant": df_rows['tenant'],
+                "network": df_rows['network'],
+                "メンテナンス": df_rows['maintenance'].map({True: "🛠️", False: ""}),
+            })
+            df_plot["表示テキスト"] = df_plot["会社"] + "<br>" + df_plot["アラーム数"].astype(str) + "件"
             
             # 全体健全性インジケーター
             health_color = '#4caf50' if overall_health > 80 else '#ffc107' if overall_health > 50 else '#f44336'
-            st.markdown(f"""
-            <div style="text-align: center; margin-bottom: 10px;">
-                <span style="font-size: 14px; color: #666;">全体健全性</span>
-                <div style="
-                    display: inline-block;
-                    margin-left: 10px;
-                    background: linear-gradient(to right, #e0e0e0, #f5f5f5);
-                    border-radius: 20px;
-                    width: 200px;
-                    height: 8px;
-                    position: relative;
-                ">
-                    <div style="
-                        width: {overall_health}%;
-                        height: 100%;
-                        background: {health_color};
-                        border-radius: 20px;
-                    "></div>
-                </div>
-                <span style="
-                    margin-left: 10px;
-                    font-weight: bold;
-                    color: {health_color};
-                ">{overall_health:.0f}%</span>
-            </div>
-            """, unsafe_allow_html=True)
+            st.markdown(_HEALTH_BAR_HTML.format(health=overall_health, color=health_color), unsafe_allow_html=True)
             
             # バブルチャートの作成（改良版：密集配置と動的サイズ）
             if len(df_plot) > 0:
@@ -374,67 +536,51 @@ def _render_all_companies_board(selected_scenario: str, df_height: int = 220):
                 
                 # X, Y座標の生成（密集配置、間隔を動的に調整）
                 spacing = 1.0 if n_companies <= 10 else 0.8  # 会社が多い場合は間隔を狭める
-                x_coords = []
-                y_coords = []
-                for i in range(n_companies):
-                    # ジグザグ配置で視認性向上
-                    row = i // cols
-                    col = i % cols
-                    # 偶数行は少しずらす
-                    x_offset = 0.2 if row % 2 == 1 else 0
-                    x = col * spacing + x_offset
-                    y = row * spacing
-                    x_coords.append(x)
-                    y_coords.append(y)
-                
-                df_plot['x'] = x_coords
-                df_plot['y'] = y_coords
+                idx = np.arange(n_companies)
+                grid_row = idx // cols
+                grid_col = idx % cols
+                # ジグザグ配置で視認性向上（奇数行は少しずらす）
+                df_plot['x'] = grid_col * spacing + 0.2 * (grid_row & 1)
+                df_plot['y'] = grid_row * spacing
                 
                 # バブルサイズの計算（より明確な差をつける）
                 # アラーム数に応じて3段階のサイズ設定
-                sizes = []
-                for alarm_count in df_plot['アラーム数']:
-                    if alarm_count == 0:
-                        size = 25  # 最小サイズ
-                    elif alarm_count <= 5:
-                        size = 35 + alarm_count * 5  # 小〜中サイズ
-                    elif alarm_count <= 15:
-                        size = 60 + (alarm_count - 5) * 3  # 中〜大サイズ
-                    else:
-                        size = min(100, 90 + (alarm_count - 15) * 1)  # 最大サイズ（上限設定）
-                    sizes.append(size)
-                df_plot['size'] = sizes
+                a = df_plot['アラーム数'].to_numpy()
+                df_plot['size'] = np.select(
+                    [a == 0, a <= 5, a <= 15],
+                    [25, 35 + a * 5, 60 + (a - 5) * 3],  # 最小 / 小〜中 / 中〜大
+                    default=np.minimum(100, 90 + (a - 15)),  # 最大サイズ（上限設定）
+                )
                 
                 fig = go.Figure()
                 
-                # 各ステータスごとにトレースを追加（凡例のため）
-                for status in ["停止", "要対応", "注意", "正常"]:
-                    df_status = df_plot[df_plot['ステータス'] == status]
-                    if len(df_status) > 0:
-                        fig.add_trace(go.Scatter(
-                            x=df_status['x'],
-                            y=df_status['y'],
-                            mode='markers+text',
-                            name=status,
-                            text=df_status['会社'],
-                            textposition="middle center",
-                            marker=dict(
-                                size=df_status['size'],
-                                color=df_status['色値'],
-                                colorscale=[
-                                    [0, '#2e7d32'],      # 濃い緑（健全）
-                                    [0.3, '#66bb6a'],    # 緑
-                                    [0.5, '#fdd835'],    # 黄
-                                    [0.7, '#ff9800'],    # オレンジ
-                                    [0.85, '#f44336'],   # 赤
-                                    [1, '#b71c1c']       # 濃い赤（危機的）
-                                ],
-                                line=dict(width=2, color='white'),
-                                showscale=False,
-                                opacity=0.9  # 少し透明感を持たせる
-                            ),
-                            customdata=df_status[['tenant', 'network', 'アラーム数']],
-                            hovertemplate='<b>%{text}</b><br>アラーム: %{customdata[2]}件<extra></extra>'
+                # 全社を1トレースで描画（点のインデックス = df_plot の行番号になり、選択処理がそのまま対応する）
+                fig.add_trace(go.Scattergl(
+                    x=df_plot['x'],
+                    y=df_plot['y'],
+                    mode='markers+text',
+                    text=df_plot['会社'],
+                    textposition="middle center",
+                    marker=dict(
+                        size=df_plot['size'],
+                        color=df_plot['色値'],
+                        colorscale=HEATMAP_COLORSCALE,
+                        cmin=0, cmax=100,
+                        line=dict(width=2, color='white'),
+                        showscale=False,
+                        opacity=0.9  # 少し透明感を持たせる
+                    ),
+                    customdata=df_plot[['tenant', 'network', 'アラーム数']],
+                    hovertemplate='<b>%{text}</b><br>アラーム: %{customdata[2]}件<extra></extra>',
+                    showlegend=False
+                ))
+                # 凡例は点を持たない見出し用トレースで表示（出現したステータスのみ）
+                present = set(df_plot['ステータス'])
+                for status, legend_color in HEATMAP_LEGEND_COLORS.items():
+                    if status in present:
+                        fig.add_trace(go.Scattergl(
+                            x=[None], y=[None], mode='markers', name=status,
+                            marker=dict(size=12, color=legend_color)
                         ))
                 
                 fig.update_layout(
@@ -457,6 +603,8 @@ def _render_all_companies_board(selected_scenario: str, df_height: int = 220):
                     paper_bgcolor='rgba(0,0,0,0)',
                     margin=dict(t=20, b=20, l=20, r=20),
                     hovermode='closest',
+                    hoverdistance=20,  # ホバー判定の探索半径を制限
+                    spikedistance=0,
                     clickmode='event+select',
                     legend=dict(
                         orientation="h",
@@ -483,11 +631,11 @@ def _render_all_companies_board(selected_scenario: str, df_height: int = 220):
                             idx = indices[0]
                             if 0 <= idx < len(df_plot):
                                 selected = df_plot.iloc[idx]
-                                st.session_state.selected_scope = {
-                                    "tenant": selected['tenant'],
-                                    "network": selected['network']
-                                }
-                                st.rerun()
+                                pick = (selected['tenant'], selected['network'])
+                                # 選択は再実行後も残るので、変わったときだけ反映（コックピットは同じ実行内で後から描画される）
+                                if st.session_state.get("heatmap_last_pick") != pick:
+                                    st.session_state.heatmap_last_pick = pick
+                                    _select_scope(*pick)
     
     with tab2:
         # 3. トリアージ・コマンドセンター（改良版）
@@ -537,135 +685,71 @@ def _render_all_companies_board(selected_scenario: str, df_height: int = 220):
                 key="sort_by"
             )
         
-        # フィルタ適用
-        filtered_rows = [
-            r for r in rows 
-            if r['status'] in filter_status 
-            and filter_alarm[0] <= r['alarm_count'] <= filter_alarm[1]
-            and (show_maint or not r['maintenance'])
-        ]
+        # フィルタ適用（列の配列に対するマスクで一括判定し、該当行の dict をそのまま使う）
+        alarm_values = df_rows['alarm_count'].to_numpy()
+        mask = (
+            df_rows['status'].isin(filter_status).to_numpy()
+            & (alarm_values >= filter_alarm[0])
+            & (alarm_values <= filter_alarm[1])
+        )
+        if not show_maint:
+            mask &= ~df_rows['maintenance'].to_numpy(dtype=bool)
+        filtered_rows = [rows[i] for i in np.flatnonzero(mask)]
         
-        # ソート
+        # ソート（既定は上位 TRIAGE_MAX_ROWS 件だけを部分選択。全件表示を選んだときのみ全体をソート）
         if sort_by == "優先度順":
-            filtered_rows.sort(key=lambda x: (x['priority'], -x['alarm_count']))
+            sort_key = lambda x: (x['priority'], -x['alarm_count'])
         elif sort_by == "アラーム数順":
-            filtered_rows.sort(key=lambda x: -x['alarm_count'])
+            sort_key = lambda x: -x['alarm_count']
+        else:
+            sort_key = lambda x: x['company_network']
+        show_all = False
+        if len(filtered_rows) > TRIAGE_MAX_ROWS:
+            show_all = st.toggle(
+                f"全 {len(filtered_rows)} 件を表示（既定は上位 {TRIAGE_MAX_ROWS} 件）",
+                key="triage_show_all"
+            )
+        if show_all:
+            filtered_rows.sort(key=sort_key)
         else:
-            filtered_rows.sort(key=lambda x: x['company_network'])
+            filtered_rows = heapq.nsmallest(TRIAGE_MAX_ROWS, filtered_rows, key=sort_key)
         
         if filtered_rows:
-            # 改良版トリアージリスト
-            for idx, r in enumerate(filtered_rows):
-                with st.container():
-                    cols = st.columns([0.5, 3, 1.5, 1.5, 1, 1])
-                    
-                    # ステータスアイコン
-                    with cols[0]:
-                        icon = {"停止": "🔴", "要対応": "🟠", "注意": "🟡", "正常": "🟢"}[r['status']]
-                        st.markdown(f"### {icon}")
-                    
-                    # 会社情報
-                    with cols[1]:
-                        st.markdown(f"**{r['company_network']}**")
-                        if r['maintenance']:
-                            st.caption("🛠️ メンテナンス中")
-                    
-                    # 深刻度（改良版：コンパクトで動的なプログレスバー）
-                    with cols[2]:
-                        # アラーム数とステータスに基づく深刻度計算
-                        if r['status'] == "停止":
-                            severity = 100
-                            bar_color = '#d32f2f'  # 濃い赤
-                            text_color = '#ffffff'
-                        elif r['status'] == "要対応":
-                            # アラーム数に応じて70-95%の範囲で変動
-                            severity = min(95, 70 + r['alarm_count'] * 2)
-                            bar_color = '#f57c00'  # オレンジ
-                            text_color = '#ffffff'
-                        elif r['status'] == "注意":
-                            # アラーム数に応じて30-60%の範囲で変動
-                            severity = min(60, 30 + r['alarm_count'] * 3)
-                            bar_color = '#fbc02d'  # 黄色
-                            text_color = '#000000'
-                        else:
-                            severity = max(5, r['alarm_count'] * 2)  # 正常でも少し表示
-                            bar_color = '#66bb6a'  # 緑
-                            text_color = '#ffffff'
-                        
-                        # コンパクトなプログレスバー（高さを抑える）
-                        st.markdown(f"""
-                        <div style="margin: 0; padding: 0;">
-                            <div style="
-                                background: linear-gradient(to right, #e8e8e8 0%, #f5f5f5 100%);
-                                border-radius: 8px;
-                                overflow: hidden;
-                                height: 24px;
-                                position: relative;
-                                box-shadow: inset 0 1px 3px rgba(0,0,0,0.2);
-                            ">
-                                <div style="
-                                    width: {severity}%;
-                                    height: 100%;
-                                    background: {bar_color};
-                                    background: linear-gradient(90deg, 
-                                        {bar_color} 0%, 
-                                        {bar_color}dd {severity}%, 
-                                        {bar_color}88 100%);
-                                    display: flex;
-                                    align-items: center;
-                                    justify-content: center;
-                                    position: relative;
-                                    transition: width 0.3s ease;
-                                    box-shadow: 0 2px 4px rgba(0,0,0,0.2);
-                                ">
-                                    <span style="
-                                        color: {text_color};
-                                        font-weight: bold;
-                                        font-size: 12px;
-                                        text-shadow: 0 1px 2px rgba(0,0,0,0.3);
-                                        position: absolute;
-                                    ">{severity}%</span>
-                                </div>
-                            </div>
-                            <div style="
-                                font-size: 10px;
-                                color: #666;
-                                margin-top: 2px;
-                                display: flex;
-                                justify-content: space-between;
-                            ">
-                                <span>深刻度</span>
-                                <span>{r['alarm_count']}件</span>
-                            </div>
-                        </div>
-                        """, unsafe_allow_html=True)
-                    
-                    # MTTR
-                    with cols[3]:
-                        st.metric("推定MTTR", r['mttr'], label_visibility="collapsed")
-                        st.caption("復旧時間")
-                    
-                    # アクションボタン
-                    with cols[4]:
-                        if st.button("📋", key=f"detail_{r['tenant']}_{r['network']}", help="詳細を表示"):
-                            st.session_state.selected_scope = {
-                                "tenant": r['tenant'],
-                                "network": r['network']
-                            }
-                            st.rerun()
-                    
-                    with cols[5]:
-                        if r['status'] in ["停止", "要対応"]:
-                            if st.button("🚀", key=f"action_{r['tenant']}_{r['network']}", 
-                                       type="primary", help="自動対応を開始"):
-                                st.session_state.selected_scope = {
-                                    "tenant": r['tenant'],
-                                    "network": r['network']
-                                }
-                                st.session_state.auto_remediate = True
-                                st.rerun()
-                    
-                    st.divider()
+            # 改良版トリアージリスト（行ごとの st.columns ではなく1つの表で描画）
+            df_triage = pd.DataFrame({
+                "状態": [{"停止": "🔴", "要対応": "🟠", "注意": "🟡", "正常": "🟢"}[r['status']] for r in filtered_rows],
+                "会社 / ネットワーク": [r['company_network'] for r in filtered_rows],
+                "メンテナンス": ["🛠️ メンテナンス中" if r['maintenance'] else "" for r in filtered_rows],
+                "深刻度": [_triage_severity(r) for r in filtered_rows],
+                "アラーム数": [r['alarm_count'] for r in filtered_rows],
+                "推定MTTR": [r['mttr'] for r in filtered_rows],
+            })
+            triage_event = st.dataframe(
+                df_triage,
+                column_config={
+                    "深刻度": st.column_config.ProgressColumn("深刻度", format="%d%%", min_value=0, max_value=100),
+                },
+                use_container_width=True, hide_index=True,
+                selection_mode="single-row", on_select="rerun", key="triage_table"
+            )
+            
+            # 選択行に対するアクション
+            if triage_event.selection and len(triage_event.selection.rows) > 0:
+                r = filtered_rows[triage_event.selection.rows[0]]
+                act1, act2 = st.columns(2)
+                with act1:
+                    st.button(
+                        f"📋 {r['company_network']} の詳細を表示", key="triage_detail", use_container_width=True,
+                        on_click=_select_scope, args=(r['tenant'], r['network'])
+                    )
+                with act2:
+                    if r['status'] in ["停止", "要対応"]:
+                        st.button(
+                            "🚀 自動対応を開始", key="triage_action", type="primary", use_container_width=True,
+                            on_click=_select_scope, args=(r['tenant'], r['network']), kwargs={"auto_remediate": True}
+                        )
+            else:
+                st.caption("行を選択すると詳細表示・自動対応ができます。")
         else:
             st.info("フィルタ条件に該当するシステムはありません。")
     
@@ -685,35 +769,30 @@ def _render_all_companies_board(selected_scenario: str, df_height: int = 220):
             st.info(f"**自動解決率**: {resolution_rate}")
         
         if PLOTLY_AVAILABLE:
-            # モックデータ生成
-            hours = list(range(24))
+            # モックデータ生成（24時間分を配列演算で一括生成）
+            hours = np.arange(24)
             current_hour = datetime.now().hour
+            rng = np.random.default_rng()
             
-            trend_data = []
-            for h in hours:
-                base = 5 + abs(h - 12) * 2  # 昼間に多い傾向
-                if h == current_hour:
-                    stop = count_stop
-                    action = count_action
-                    warn = count_warn
-                else:
-                    import random
-                    stop = max(0, base // 10 + random.randint(-1, 1))
-                    action = base // 5 + random.randint(-2, 2)
-                    warn = base // 3 + random.randint(-3, 3)
-                
-                trend_data.append({
-                    "時刻": f"{h:02d}:00",
-                    "停止": stop,
-                    "要対応": action,
-                    "注意": warn
-                })
+            base = 5 + np.abs(hours - 12) * 2  # 昼間に多い傾向
+            stop = np.maximum(0, base // 10 + rng.integers(-1, 2, size=24))
+            action = base // 5 + rng.integers(-2, 3, size=24)
+            warn = base // 3 + rng.integers(-3, 4, size=24)
+            # 現在時刻は実際の集計値
+            stop[current_hour] = count_stop
+            action[current_hour] = count_action
+            warn[current_hour] = count_warn
             
-            df_trend = pd.DataFrame(trend_data)
+            df_trend = pd.DataFrame({
+                "時刻": [f"{h:02d}:00" for h in range(24)],
+                "停止": stop,
+                "要対応": action,
+                "注意": warn
+            })
             
-            # Plotlyグラフ
+            # Plotlyグラフ（WebGL 描画）
             fig_trend = go.Figure()
-            fig_trend.add_trace(go.Scatter(
+            fig_trend.add_trace(go.Scattergl(
                 x=df_trend['時刻'], y=df_trend['停止'],
                 mode='lines+markers', name='停止',
                 line=dict(color='#ef5350', width=3),
@@ -721,7 +800,7 @@ def _render_all_companies_board(selected_scenario: str, df_height: int = 220):
                 fill='tozeroy',
                 fillcolor='rgba(239, 83, 80, 0.2)'
             ))
-            fig_trend.add_trace(go.Scatter(
+            fig_trend.add_trace(go.Scattergl(
                 x=df_trend['時刻'], y=df_trend['要対応'],
                 mode='lines+markers', name='要対応',
                 line=dict(color='#fb8c00', width=2),
@@ -729,7 +808,7 @@ def _render_all_companies_board(selected_scenario: str, df_height: int = 220):
                 fill='tozeroy',
                 fillcolor='rgba(251, 140, 0, 0.1)'
             ))
-            fig_trend.add_trace(go.Scatter(
+            fig_trend.add_trace(go.Scattergl(
                 x=df_trend['時刻'], y=df_trend['注意'],
                 mode='lines+markers', name='注意',
                 line=dict(color='#fbc02d', width=1),
@@ -738,7 +817,8 @@ def _render_all_companies_board(selected_scenario: str, df_height: int = 220):
             
             fig_trend.update_layout(
                 height=300,
-                hovermode='x unified',
+                hovermode='x unified',  # x ごとに1回の参照で済ませる
+                spikedistance=-1,
                 xaxis_title="時刻",
                 yaxis_title="発生件数",
                 showlegend=True,
@@ -770,23 +850,39 @@ def _get_impact_label(cand: dict, scope_status: str) -> str:
     elif prob_pct >= ImpactLevel.DOWNSTREAM: return "⚪ 下流影響"
     else: return "⚪ 低優先度"
 
-def find_target_node_id(topology, node_type=None, layer=None, keyword=None):
-    return _find_target_node_id(topology, node_type, layer, keyword)
+@lru_cache(maxsize=256)
+def _read_config(path: str, mtime: float) -> str:
+    with open(path, "r", encoding="utf-8") as f: return f.read()
 
-def load_config_by_id(device_id):
+CONFIG_NOT_FOUND = "Config file not found."
+
+def _resolve_config(device_id) -> tuple[str, float] | None:
+    """device_id → (コンフィグのパス, mtime)。見つからなければ None"""
     possible_paths = [f"configs/{device_id}.txt", f"{device_id}.txt"]
     for path in possible_paths:
-        if os.path.exists(path):
-            try:
-                with open(path, "r", encoding="utf-8") as f: return f.read()
-            except: pass
-    return "Config file not found."
+        # exists() を挟まず stat の失敗で判定（存在確認と読込の間の競合も避ける）
+        try:
+            return path, os.path.getmtime(path)
+        except OSError:
+            continue
+    return None
+
+def load_config_by_id(device_id):
+    resolved = _resolve_config(device_id)
+    if resolved is None:
+        return CONFIG_NOT_FOUND
+    try:
+        return _read_config(*resolved)
+    except OSError:
+        return CONFIG_NOT_FOUND
+
+_ENCRYPTED_PW_RE = re.compile(r"(encrypted-password\s+)([\"']?)[^\"';\n]+([\"']?)", re.IGNORECASE)
+_IPV4_HOST_RE = re.compile(r"\b(\d{1,3}\.\d{1,3}\.\d{1,3})\.(\d{1,3})(/\d{1,2})?\b")
 
 def sanitize_config_text(raw_text: str) -> str:
     if not raw_text: return raw_text
-    text = raw_text
-    text = re.sub(r"(encrypted-password\s+)([\"']?)[^\"';\n]+([\"']?)", r"\1\2***REDACTED***\3", text, flags=re.IGNORECASE)
-    text = re.sub(r"\b(\d{1,3}\.\d{1,3}\.\d{1,3})\.(\d{1,3})(/\d{1,2})?\b", r"\1.xxx\3", text)
+    text = _ENCRYPTED_PW_RE.sub(r"\1\2***REDACTED***\3", raw_text)
+    text = _IPV4_HOST_RE.sub(r"\1.xxx\3", text)
     return text
 
 def build_config_summary(sanitized_text: str) -> dict:
@@ -803,65 +899,190 @@ def build_config_summary(sanitized_text: str) -> dict:
         if z not in summary["zones"]: summary["zones"].append(z)
     return summary
 
-def load_config_sanitized(device_id: str) -> dict:
-    raw = load_config_by_id(device_id)
+@st.cache_data(max_entries=256, show_spinner=False)
+def _sanitized_config(device_id: str, resolved: tuple[str, float] | None) -> dict:
+    """サニタイズ・要約はファイル (path, mtime) ごとに1回だけ"""
+    raw = CONFIG_NOT_FOUND
+    if resolved is not None:
+        try:
+            raw = _read_config(*resolved)
+        except OSError:
+            pass
     sanitized = sanitize_config_text(raw)
     summary = build_config_summary(sanitized)
     excerpt = sanitized[:1500] if isinstance(sanitized, str) else ""
-    return {"device_id": device_id, "summary": summary, "excerpt": excerpt, "available": (raw != "Config file not found.")}
+    return {"device_id": device_id, "summary": summary, "excerpt": excerpt, "available": (raw != CONFIG_NOT_FOUND)}
 
-def generate_content_with_retry(model, prompt, stream=True, retries=3):
+def load_config_sanitized(device_id: str) -> dict:
+    return _sanitized_config(device_id, _resolve_config(device_id))
+
+CHAT_MODEL_NAME = "gemma-3-12b-it"
+
+@st.cache_resource(max_entries=16, show_spinner=False)
+def _cached_genai_model(key_hash: str, model_name: str, _api_key: str) -> genai.GenerativeModel:
+    # _api_key はハッシュ対象外（キャッシュキーは key_hash）。クライアントは生成時にこのキーへ固定される
+    return build_model_for_key(_api_key, model_name)
+
+def _get_genai_model(api_key: str, model_name: str = CHAT_MODEL_NAME) -> genai.GenerativeModel:
+    """レポート・チャット用モデル（同じ API Key のインスタンスはプロセス内で共有）"""
+    return _cached_genai_model(api_key_hash(api_key), model_name, api_key)
+
+# チャット応答の上限（長文生成で初回表示以降の待ち時間が伸びないように）
+CHAT_GENERATION_CONFIG = {"max_output_tokens": 512}
+
+def _call_with_retry(fn, retries=3):
     for i in range(retries):
         try:
-            return model.generate_content(prompt, stream=stream)
+            return fn()
         except google_exceptions.ServiceUnavailable:
             if i == retries - 1: raise
             time.sleep(2 * (i + 1))
     return None
 
-def render_topology(alarms, root_cause_candidates):
-    graph = graphviz.Digraph()
-    graph.attr(rankdir='TB')
-    graph.attr('node', shape='box', style='rounded,filled', fontname='Helvetica')
-    
-    alarm_map = {a.device_id: a for a in alarms}
-    alarmed_ids = set(alarm_map.keys())
-    node_status_map = {c['id']: c['type'] for c in root_cause_candidates}
-    
-    for node_id, node in TOPOLOGY.items():
-        color = "#e8f5e9"
-        penwidth = "1"
-        fontcolor = "black"
+def generate_content_with_retry(model, prompt, stream=True, retries=3):
+    return _call_with_retry(lambda: model.generate_content(prompt, stream=stream), retries)
+
+def send_message_with_retry(chat_session, prompt, retries=3):
+    """チャット履歴を保ったままストリーミングで送信"""
+    return _call_with_retry(
+        lambda: chat_session.send_message(prompt, stream=True, generation_config=CHAT_GENERATION_CONFIG),
+        retries,
+    )
+
+def render_topology(alarmed_ids: frozenset, root_cause_candidates) -> str:
+    """トポロジー図の DOT ソース（アラーム集合・根本原因候補が同じ再実行ではキャッシュを返す）"""
+    # 描画に効くのは状態の分類だけなので、分類に落としてからキーにする（確率・ラベルの変化ではキャッシュを外さない）
+    node_classes = {node_id: _node_status_class(t) for node_id, t in {c['id']: c['type'] for c in root_cause_candidates}.items()}
+    node_status = tuple(sorted((node_id, cls) for node_id, cls in node_classes.items() if cls))
+    return _build_dot_source(engine_sig, alarmed_ids, node_status, TOPOLOGY, REDUNDANCY_INDEX)
+
+def _node_status_class(status_type: str) -> str | None:
+    """根本原因候補の type → 描画上の分類（silent / root / unreachable / None）"""
+    if "Silent" in status_type:
+        return "silent"
+    if "Hardware/Physical" in status_type or "Critical" in status_type:
+        return "root"
+    if "Network/Unreachable" in status_type or "Network/Secondary" in status_type:
+        return "unreachable"
+    return None
+
+@dataclass(frozen=True)
+class _SkeletonNode:
+    """トポロジー骨格の1ノード分（状態に依らない部分を事前に組み立てたもの）"""
+    node_id: str
+    q_id: str
+    label: str          # 状態サフィックスを付ける前のラベル
+    default_line: str   # 正常時のノード行
+    edge_lines: tuple   # このノードに入るエッジ行
+
+def _dot_node_line(q_id: str, label: str, color: str, fontcolor: str = "black", penwidth: str = "1") -> str:
+    return (
+        f'\t{q_id} [label={_dot_quote(label)} color=black fillcolor="{color}" '
+        f'fontcolor="{fontcolor}" penwidth={penwidth}]'
+    )
+
+@st.cache_resource(max_entries=16, show_spinner=False)
+def _topology_skeleton(topology_sig: str, _topology: dict, _redundancy_index: dict) -> tuple:
+    """
+    ノードの基本ラベル・正常時の行・エッジ行（トポロジーごとに1回だけ組み立てる）
+    _topology / _redundancy_index はハッシュ対象外（topology_sig で識別）
+    """
+    skeleton = []
+    for node_id, node in _topology.items():
         label = f"{node_id}\n({node.type})"
-        
         red_type = node.metadata.get("redundancy_type")
         if red_type: label += f"\n[{red_type} Redundancy]"
         vendor = node.metadata.get("vendor")
         if vendor: label += f"\n[{vendor}]"
 
-        status_type = node_status_map.get(node_id, "Normal")
+        q_id = _dot_quote(node_id)
+        edge_lines = []
+        # 冗長ペアは _redundancy_index から引く
+        if node.parent_id:
+            edge_lines.append(f"\t{_dot_quote(node.parent_id)} -> {q_id}")
+            parent_node = _topology.get(node.parent_id)
+            if parent_node and parent_node.redundancy_group:
+                for partner_id in _redundancy_index.get(parent_node.redundancy_group, ()):
+                    if partner_id != parent_node.id:
+                        edge_lines.append(f"\t{_dot_quote(partner_id)} -> {q_id}")
+        skeleton.append(_SkeletonNode(node_id, q_id, label, _dot_node_line(q_id, label, "#e8f5e9"), tuple(edge_lines)))
+    return tuple(skeleton)
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def _build_dot_source(topology_sig: str, alarmed_ids: frozenset, node_status: tuple, _topology: dict, _redundancy_index: dict) -> str:
+    # _topology / _redundancy_index はハッシュ対象外（topology_sig で識別）
+    # 骨格（キャッシュ済み）の行を並べ、状態のあるノードの行だけ組み立て直す
+    lines = ["digraph {", "\trankdir=TB", '\tnode [fontname=Helvetica shape=box style="rounded,filled"]']
+    
+    status_of = dict(node_status).get
+    
+    for sk in _topology_skeleton(topology_sig, _topology, _redundancy_index):
+        status_class = status_of(sk.node_id)
         
-        if "Silent" in status_type:
-            color = "#fff3e0"; penwidth = "4"; label += "\n[サイレント疑い]"
-        elif "Hardware/Physical" in status_type or "Critical" in status_type:
-            color = "#ffcdd2"; penwidth = "3"; label += "\n[ROOT CAUSE]"
-        elif "Network/Unreachable" in status_type or "Network/Secondary" in status_type:
-            color = "#cfd8dc"; fontcolor = "#546e7a"; label += "\n[Unreachable]"
-        elif node_id in alarmed_ids:
-            color = "#fff9c4" 
+        if status_class == "silent":
+            lines.append(_dot_node_line(sk.q_id, sk.label + "\n[サイレント疑い]", "#fff3e0", penwidth="4"))
+        elif status_class == "root":
+            lines.append(_dot_node_line(sk.q_id, sk.label + "\n[ROOT CAUSE]", "#ffcdd2", penwidth="3"))
+        elif status_class == "unreachable":
+            lines.append(_dot_node_line(sk.q_id, sk.label + "\n[Unreachable]", "#cfd8dc", fontcolor="#546e7a"))
+        elif sk.node_id in alarmed_ids:
+            lines.append(_dot_node_line(sk.q_id, sk.label, "#fff9c4"))
+        else:
+            lines.append(sk.default_line)
         
-        graph.node(node_id, label=label, fillcolor=color, color='black', penwidth=penwidth, fontcolor=fontcolor)
+        lines.extend(sk.edge_lines)
+    lines.append("}")
+    return "\n".join(lines)
+
+def _dot_quote(text: str) -> str:
+    """DOT の二重引用符文字列（改行は DOT の \\n に変換）"""
+    escaped = str(text).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return f'"{escaped}"'
+
+# st.fragment（旧 experimental_fragment）が無いバージョンでは通常の関数として描画
+_fragment_api = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+_fragment = _fragment_api or (lambda f: f)
+
+@_fragment
+def _topology_fragment(alarmed_ids: frozenset, root_cause_candidates):
+    """トポロジー図の描画をフラグメントとして分離（DOT ソースは _build_dot_source でキャッシュ）"""
+    st.graphviz_chart(render_topology(alarmed_ids, root_cause_candidates), use_container_width=True)
+
+CHAT_HISTORY_TAIL = 20
+
+@_fragment
+def _chat_fragment(api_key: str | None, is_normal_scenario: bool):
+    """チャット欄をフラグメントとして分離（入力のたびにトポロジー・全社ボード・候補表を再実行しない）"""
+    if st.session_state.chat_session is None and api_key and not is_normal_scenario:
+        st.session_state.chat_session = _get_genai_model(api_key).start_chat(history=[])
     
-    for node_id, node in TOPOLOGY.items():
-        if node.parent_id:
-            graph.edge(node.parent_id, node_id)
-            parent_node = TOPOLOGY.get(node.parent_id)
-            if parent_node and parent_node.redundancy_group:
-                partners = [n.id for n in TOPOLOGY.values() 
-                           if n.redundancy_group == parent_node.redundancy_group and n.id != parent_node.id]
-                for partner_id in partners:
-                    graph.edge(partner_id, node_id)
-    return graph
+    # 履歴は直近 CHAT_HISTORY_TAIL 件だけ描画（古いものは明示的に開いたときのみ）
+    messages = st.session_state.messages
+    older = len(messages) - CHAT_HISTORY_TAIL
+    if older > 0 and not st.toggle(f"以前のメッセージを表示 ({older}件)", key="chat_show_older"):
+        messages = messages[older:]
+    for msg in messages:
+        with st.chat_message(msg["role"]): st.markdown(msg["content"])
+
+    if prompt := st.chat_input("Ask details..."):
+        st.session_state.messages.append({"role": "user", "content": prompt})
+        with st.chat_message("user"): st.markdown(prompt)
+        if st.session_state.chat_session:
+            with st.chat_message("assistant"):
+                # スピナーは最初のチャンクが届くまで。以降はトークン到着ごとに描画する
+                with st.spinner("Thinking..."):
+                    response = send_message_with_retry(st.session_state.chat_session, prompt)
+                if response:
+                    full_response = st.write_stream(chunk.text for chunk in response)
+                    st.session_state.messages.append({"role": "assistant", "content": full_response})
+
+def _build_redundancy_index(topology: dict) -> dict[str, list[str]]:
+    """redundancy_group → ノードID一覧"""
+    index = defaultdict(list)
+    for node_id, node in topology.items():
+        if node.redundancy_group:
+            index[node.redundancy_group].append(node_id)
+    return index
 
 # --- UI構築 ---
 
@@ -886,7 +1107,7 @@ with st.sidebar:
 
     if 'maint_flags' not in st.session_state: st.session_state.maint_flags = {}
     with st.expander('🛠️ Maintenance', expanded=False):
-        ts = list_tenants() if list_tenants() else ['A','B']
+        ts = list_tenants() or ['A','B']
         selected = st.multiselect('Maintenance 中の会社', options=ts, default=[t for t in ts if st.session_state.maint_flags.get(t, False)], format_func=display_company)
         st.session_state.maint_flags = {t: (t in selected) for t in ts}
 
@@ -899,7 +1120,11 @@ with st.sidebar:
 
 # --- セッション管理 ---
 if "current_scenario" not in st.session_state: st.session_state.current_scenario = "正常稼働"
-if "selected_scope" not in st.session_state: st.session_state.selected_scope = None
+if "selected_scope" not in st.session_state:
+    # URL にスコープがあればそれを初期選択にする（レジストリに存在する組み合わせのみ。それ以外は既定スコープ）
+    _qt, _qn = st.query_params.get("t"), st.query_params.get("n")
+    _known = _qt and _qn and any(p.tenant_id == _qt and p.network_id == _qn for p in list_scopes())
+    st.session_state.selected_scope = {"tenant": _qt, "network": _qn} if _known else None
 
 # ======================================================================================
 # 上段の全社状態ボード
@@ -925,19 +1150,27 @@ else:
     st.session_state.selected_scope = {"tenant": _t0, "network": _n0}
 
 _paths = get_paths(ACTIVE_TENANT, ACTIVE_NETWORK)
-TOPOLOGY = load_topology(_paths.topology_path)
+# 全社ビューで計算済みのトポロジ・アラームを再利用
+_active_mtime = topology_mtime(_paths.topology_path)
+_scope = _scope_state(_paths.topology_path, _active_mtime, selected_scenario)
+TOPOLOGY = _scope.topology
+REDUNDANCY_INDEX = _build_redundancy_index(TOPOLOGY)
 
 for key in ["live_result", "messages", "chat_session", "trigger_analysis", "verification_result", "generated_report", "verification_log", "last_report_cand_id", "logic_engine"]:
     if key not in st.session_state:
         st.session_state[key] = None if key != "messages" and key != "trigger_analysis" else ([] if key == "messages" else False)
 
-try:
-    topo_mtime = os.path.getmtime(_paths.topology_path)
-except: topo_mtime = 0.0
-engine_sig = f"{ACTIVE_TENANT}/{ACTIVE_NETWORK}:{topo_mtime}"
+engine_sig = f"{ACTIVE_TENANT}/{ACTIVE_NETWORK}:{_active_mtime}"
+LOGIC_ENGINE_CACHE_SIZE = 16
 
 if st.session_state.get("logic_engine_sig") != engine_sig:
-    st.session_state.logic_engine = LogicalRCA(TOPOLOGY)
+    # スコープを行き来しても再構築しないよう、セッション内でスコープ別に保持
+    _engines = st.session_state.setdefault("logic_engines", {})
+    if engine_sig not in _engines:
+        if len(_engines) >= LOGIC_ENGINE_CACHE_SIZE:
+            _engines.pop(next(iter(_engines)))
+        _engines[engine_sig] = LogicalRCA(TOPOLOGY)
+    st.session_state.logic_engine = _engines[engine_sig]
     st.session_state.logic_engine_sig = engine_sig
 
 if st.session_state.current_scenario != selected_scenario:
@@ -948,25 +1181,103 @@ if st.session_state.current_scenario != selected_scenario:
     if "remediation_plan" in st.session_state: del st.session_state.remediation_plan
     st.rerun()
 
-alarms = _make_alarms(TOPOLOGY, selected_scenario)
+alarms = list(_scope.alarms)
+# シナリオ名の解析はこの再実行で1回だけ
+scenario_key = parse_scenario(selected_scenario)
 target_device_id = None
 root_severity = "CRITICAL"
 
-engine = st.session_state.logic_engine
-engine.SILENT_RATIO = 0.3 if "サイレント" in selected_scenario else 0.5
-analysis_results = engine.analyze(alarms)
+def _candidate_status_action(cand: dict) -> tuple[str, str]:
+    status = "⚪ 監視中"; action = "👁️ 静観"
+    is_silent = ("Silent" in str(cand.get("type","")) or "サイレント" in str(cand.get("type","")))
+    if is_silent:
+        status = "🟣 サイレント疑い (上位設備)"; action = "🔍 上位SW/配下影響を確認"
+    else:
+        if cand['prob'] > 0.8: status = "🔴 危険 (根本原因)"; action = "🚀 自動修復が可能"
+        elif cand['prob'] > 0.6: status = "🟡 警告 (被疑箇所)"; action = "🔍 詳細調査を推奨"
+    if "Network/Unreachable" in cand['type']: status = "⚫ 応答なし (上位障害)"; action = "⛔ 対応不要"
+    return status, action
 
-scenario_impact = _get_scenario_impact_level(selected_scenario)
-if analysis_results and scenario_impact > 0:
-    top_candidate = analysis_results[0]
-    if top_candidate.get('prob', 0) > 0.5:
-        top_candidate['prob'] = scenario_impact / 100.0
-        if "サイレント" in selected_scenario or "Silent" in top_candidate.get('type', ''):
-            top_candidate['prob'] = ImpactLevel.DEGRADED_HIGH / 100.0
+def _candidate_text(cand: dict) -> str:
+    candidate_text = f"デバイス: {cand['id']} / 原因: {cand['label']}"
+    if cand.get('verification_log'): candidate_text += " [🔍 Active Probe: 応答なし]"
+    return candidate_text
+
+@dataclass(frozen=True)
+class CockpitSnapshot:
+    """コックピットの解析結果と候補表（エビデンスが同じ間はセッション内で使い回す）"""
+    analysis_results: list
+    root_cause_candidates: list
+    downstream_devices: list
+    candidate_df: pd.DataFrame
+    llm_pending: bool = False  # LLM判定待ちの暫定結果を含む（次の再実行で作り直す）
+    llm_error: bool = False  # LLM判定の一時的な失敗を含む（次の再実行で作り直して再試行する）
+
+def _build_cockpit_snapshot(engine, alarms: list, scenario_key: ScenarioKey, scope_status: str) -> CockpitSnapshot:
+    engine.SILENT_RATIO = 0.3 if scenario_key.silent else 0.5
+    analysis_results = engine.analyze(alarms)
+
+    scenario_impact = scenario_key.impact
+    if analysis_results and scenario_impact > 0:
+        top_candidate = analysis_results[0]
+        if top_candidate.get('prob', 0) > 0.5:
+            top_candidate['prob'] = scenario_impact / 100.0
+            if scenario_key.silent or "Silent" in top_candidate.get('type', ''):
+                top_candidate['prob'] = ImpactLevel.DEGRADED_HIGH / 100.0
+
+    root_cause_candidates = []
+    downstream_devices = []
+    for cand in analysis_results:
+        if "Network/Unreachable" in cand.get('type', '') or "Network/Secondary" in cand.get('type', ''):
+            downstream_devices.append(cand)
+        else:
+            root_cause_candidates.append(cand)
+
+    # 列ごとのリストから一度に DataFrame を構築（行 dict の逐次追加を避ける）
+    status_actions = [_candidate_status_action(c) for c in root_cause_candidates]
+    df = pd.DataFrame({
+        "順位": range(1, len(root_cause_candidates) + 1),
+        "ステータス": [s for s, _ in status_actions],
+        "根本原因候補": [_candidate_text(c) for c in root_cause_candidates],
+        "影響度": [_get_impact_display(c, scope_status) for c in root_cause_candidates],
+        "状態": [_get_impact_label(c, scope_status) for c in root_cause_candidates],
+        "推奨アクション": [a for _, a in status_actions],
+        "ID": [c['id'] for c in root_cause_candidates],
+        "Type": [c['type'] for c in root_cause_candidates],
+    })
+    # 判定待ちかどうかは返ってきた結果で判断する（analyze 後にワーカーが終わっても取りこぼさない）
+    llm_pending = any(r.get("type") == LLM_PENDING for r in analysis_results)
+    llm_error = any(r.get("type") == LLM_ERROR for r in analysis_results)
+    return CockpitSnapshot(analysis_results, root_cause_candidates, downstream_devices, df, llm_pending, llm_error)
 
-scope_status = _status_from_alarms(selected_scenario, alarms)
+scope_status = _scope.status
 selected_incident_candidate = None
 
+# チャット入力や展開の切替など、エビデンスが変わらない再実行では解析・候補表を作り直さない
+_cockpit_key = (engine_sig, selected_scenario, bool(os.environ.get("GOOGLE_API_KEY")))
+_cockpit = st.session_state.get("cockpit_snapshot")
+if _cockpit is None or _cockpit[0] != _cockpit_key or _cockpit[1].llm_pending or _cockpit[1].llm_error:
+    _cockpit = (_cockpit_key, _build_cockpit_snapshot(st.session_state.logic_engine, alarms, scenario_key, scope_status))
+    st.session_state.cockpit_snapshot = _cockpit
+analysis_results = _cockpit[1].analysis_results
+root_cause_candidates = _cockpit[1].root_cause_candidates
+downstream_devices = _cockpit[1].downstream_devices
+df = _cockpit[1].candidate_df
+
+LLM_POLL_SECONDS = 2
+
+def _wait_llm_verdicts():
+    """バックグラウンドのLLM判定が終わったら全体を再実行して確定結果に差し替える"""
+    if not st.session_state.logic_engine.has_pending_llm():
+        st.rerun()
+    st.caption("⏳ AI判定を実行中です。完了すると自動で更新されます。")
+
+if _cockpit[1].llm_pending:
+    if _fragment_api is not None:
+        _fragment_api(run_every=LLM_POLL_SECONDS)(_wait_llm_verdicts)()
+    else:
+        st.caption("⏳ AI判定を実行中です。完了すると自動で更新されます。")
+
 st.markdown(f"### 🛡️ AIOps インシデント・コックピット : **{display_company(ACTIVE_TENANT)}** / {ACTIVE_NETWORK}")
 col1, col2, col3 = st.columns(3)
 with col1: st.metric("📉 ノイズ削減率", "98.5%", "高効率稼働中")
@@ -977,38 +1288,9 @@ with col2: st.metric("📨 抑制アラーム数", f"{suppressed_count}件", "
 with col3: st.metric("🚨 要対応インシデント", f"{len([c for c in analysis_results if c['prob'] > 0.6])}件", "対処が必要")
 st.markdown("---")
 
-# 以下、既存のコックピット表示ロジック続き
-root_cause_candidates = []
-downstream_devices = []
-for cand in analysis_results:
-    if "Network/Unreachable" in cand.get('type', '') or "Network/Secondary" in cand.get('type', ''):
-        downstream_devices.append(cand)
-    else:
-        root_cause_candidates.append(cand)
-
 if root_cause_candidates and downstream_devices:
     st.info(f"📍 **根本原因**: {root_cause_candidates[0]['id']} → 影響範囲: 配下 {len(downstream_devices)} 機器")
 
-df_data = []
-for rank, cand in enumerate(root_cause_candidates, 1):
-    status = "⚪ 監視中"; action = "👁️ 静観"
-    is_silent = ("Silent" in str(cand.get("type","")) or "サイレント" in str(cand.get("type","")))
-    if is_silent:
-        status = "🟣 サイレント疑い (上位設備)"; action = "🔍 上位SW/配下影響を確認"
-    else:
-        if cand['prob'] > 0.8: status = "🔴 危険 (根本原因)"; action = "🚀 自動修復が可能"
-        elif cand['prob'] > 0.6: status = "🟡 警告 (被疑箇所)"; action = "🔍 詳細調査を推奨"
-    if "Network/Unreachable" in cand['type']: status = "⚫ 応答なし (上位障害)"; action = "⛔ 対応不要"
-
-    candidate_text = f"デバイス: {cand['id']} / 原因: {cand['label']}"
-    if cand.get('verification_log'): candidate_text += " [🔍 Active Probe: 応答なし]"
-    df_data.append({
-        "順位": rank, "ステータス": status, "根本原因候補": candidate_text,
-        "影響度": _get_impact_display(cand, scope_status), "状態": _get_impact_label(cand, scope_status),
-        "推奨アクション": action, "ID": cand['id'], "Type": cand['type']
-    })
-
-df = pd.DataFrame(df_data)
 st.info("💡 ヒント: インシデントの行をクリックすると、右側に詳細分析と復旧プランが表示されます。")
 
 event = st.dataframe(
@@ -1023,14 +1305,17 @@ event = st.dataframe(
 
 if downstream_devices:
     with st.expander(f"▼ 影響を受けている機器 ({len(downstream_devices)}台) - 上流復旧待ち", expanded=False):
-        dd_df = pd.DataFrame([{"No": i+1, "デバイス": d['id'], "状態": "⚫ 応答なし", "備考": "上流復旧待ち"} for i, d in enumerate(downstream_devices)])
+        dd_df = pd.DataFrame({
+            "No": range(1, len(downstream_devices) + 1),
+            "デバイス": [d['id'] for d in downstream_devices],
+            "状態": "⚫ 応答なし",
+            "備考": "上流復旧待ち",
+        })
         st.dataframe(dd_df, use_container_width=True, hide_index=True)
 
 if event.selection and len(event.selection.rows) > 0:
-    sel_row = df.iloc[event.selection.rows[0]]
-    for res in root_cause_candidates:
-        if res['id'] == sel_row['ID'] and res['type'] == sel_row['Type']:
-            selected_incident_candidate = res; break
+    # 候補表は root_cause_candidates と同じ並びで1行ずつ作っているので、行番号で直接引ける
+    selected_incident_candidate = root_cause_candidates[event.selection.rows[0]]
 else:
     selected_incident_candidate = root_cause_candidates[0] if root_cause_candidates else None
 
@@ -1039,7 +1324,7 @@ col_map, col_chat = st.columns([1.2, 1])
 
 with col_map:
     st.subheader("🌐 Network Topology")
-    st.graphviz_chart(render_topology(alarms, analysis_results), use_container_width=True)
+    _topology_fragment(_scope.alarm_ids, analysis_results)
     st.markdown("---")
     st.subheader("🛠️ Auto-Diagnostics")
     
@@ -1048,7 +1333,16 @@ with col_map:
         else:
             with st.status("Agent Operating...", expanded=True) as status:
                 target_node_obj = TOPOLOGY.get(selected_incident_candidate['id']) if selected_incident_candidate else None
-                res = run_diagnostic_simulation(selected_scenario, target_node_obj, api_key)
+                if target_node_obj and uses_ai_generated_log(selected_scenario):
+                    # AI生成ログは到着したチャンクから順に表示（サニタイズ済みの行のみ）
+                    try:
+                        log_text = st.write_stream(sanitize_stream(generate_fake_log_by_ai_stream(selected_scenario, target_node_obj, api_key)))
+                        res = {"status": "SUCCESS", "sanitized_log": log_text, "error": None}
+                    except LogGenerationError as e:
+                        # 途中で切れたログは検証に回さない
+                        res = {"status": "ERROR", "sanitized_log": "", "error": str(e)}
+                else:
+                    res = run_diagnostic_simulation(selected_scenario, target_node_obj, api_key)
                 st.session_state.live_result = res
                 if res["status"] == "SUCCESS":
                     st.write("✅ Log Acquired & Sanitized.")
@@ -1077,12 +1371,10 @@ with col_chat:
     if selected_incident_candidate:
         cand = selected_incident_candidate
         if "generated_report" not in st.session_state or st.session_state.generated_report is None:
-            if api_key and selected_scenario != "正常稼働":
+            if api_key and not scenario_key.normal:
                 if st.button("📝 詳細レポートを作成 (Generate Report)"):
-                    report_container = st.empty()
                     cfg = load_config_sanitized(cand['id'])
-                    genai.configure(api_key=api_key)
-                    model = genai.GenerativeModel("gemma-3-12b-it")
+                    model = _get_genai_model(api_key)
                     
                     prompt = f"""
                     あなたはネットワーク運用監視のプロフェッショナルです。
@@ -1098,11 +1390,8 @@ with col_chat:
                     """
                     try:
                         response = generate_content_with_retry(model, prompt, stream=True)
-                        full_text = ""
-                        for chunk in response:
-                            full_text += chunk.text
-                            report_container.markdown(full_text)
-                        st.session_state.generated_report = full_text
+                        # 到着したチャンクから順に描画
+                        st.session_state.generated_report = st.write_stream(chunk.text for chunk in response)
                     except Exception as e:
                         st.error(f"Report Generation Error: {str(e)}")
         else:
@@ -1150,26 +1439,13 @@ with col_chat:
                         del st.session_state.remediation_plan; st.rerun()
 
     with st.expander("💬 Chat with AI Agent", expanded=False):
-        if st.session_state.chat_session is None and api_key and selected_scenario != "正常稼働":
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel("gemma-3-12b-it")
-            st.session_state.chat_session = model.start_chat(history=[])
-        
-        for msg in st.session_state.messages:
-            with st.chat_message(msg["role"]): st.markdown(msg["content"])
-
-        if prompt := st.chat_input("Ask details..."):
-            st.session_state.messages.append({"role": "user", "content": prompt})
-            with st.chat_message("user"): st.markdown(prompt)
-            if st.session_state.chat_session:
-                with st.chat_message("assistant"):
-                    with st.spinner("Thinking..."):
-                        res_container = st.empty(); full_response = ""
-                        response = generate_content_with_retry(st.session_state.chat_session.model, prompt, stream=True)
-                        if response:
-                            for chunk in response: full_response += chunk.text; res_container.markdown(full_response)
-                            st.session_state.messages.append({"role": "assistant", "content": full_response})
+        _chat_fragment(api_key, scenario_key.normal)
 
 if st.session_state.trigger_analysis and st.session_state.live_result:
     st.session_state.trigger_analysis = False
     st.rerun()
+
+# フラグメントが無いバージョンでは、画面を描き終えてから少し待って再実行し、LLM判定の結果を拾う
+if _cockpit[1].llm_pending and _fragment_api is None:
+    time.sleep(LLM_POLL_SECONDS)
+    st.rerun()
@@ -92,8 +92,8 @@ def render_details(item: Dict[str, Any]):
         if auto_investigation:
             st.markdown("**推奨・能動調査（提案）**")
             if isinstance(auto_investigation, list):
-                for step in auto_investigation:
-                    st.markdown(f"- {step}")
+                # 手順ごとに要素を作らず、1つの箇条書きとしてまとめて送る
+                st.markdown("\n".join(f"- {step}" for step in auto_investigation))
             else:
                 st.write(auto_investigation)
 
@@ -6,7 +6,8 @@ Google Antigravity AIOps Agent - Data Module (Optimized Final)
 import json
 import os
 import logging
-from typing import Dict, Optional, Any
+from collections import defaultdict
+from typing import Dict, List, Optional, Any
 from dataclasses import dataclass, field
 
 # =====================================================
@@ -26,7 +27,7 @@ class TopologyConstants:
 # =====================================================
 # データクラス定義
 # =====================================================
-@dataclass
+@dataclass(slots=True)
 class NetworkNode:
     """ネットワークノードを表現するデータクラス"""
     id: str
@@ -49,6 +50,10 @@ class NetworkNode:
                 logger.warning(f"Node {self.id}: invalid layer, using default")
                 self.layer = TopologyConstants.DEFAULT_LAYER
         
+        # Type検証（参照側で str() 変換や例外処理をしなくて済むよう、ここで文字列に揃える）
+        if not isinstance(self.type, str):
+            self.type = TopologyConstants.DEFAULT_TYPE if self.type is None else str(self.type)
+        
         # Metadata検証
         if not isinstance(self.metadata, dict):
             logger.warning(f"Node {self.id}: metadata must be dict, resetting")
@@ -176,7 +181,30 @@ def _has_circular_reference(node: NetworkNode, topology: Dict[str, NetworkNode],
         return _has_circular_reference(parent, topology, visited)
     return False
 
+# =====================================================
+# 隣接インデックス構築
+# =====================================================
+def build_children_map(topology: Dict[str, NetworkNode]) -> Dict[str, List[NetworkNode]]:
+    """parent_id → 子ノード一覧（トポロジーの定義順を保持）"""
+    children_map: Dict[str, List[NetworkNode]] = defaultdict(list)
+    for n in topology.values():
+        if n.parent_id:
+            children_map[n.parent_id].append(n)
+    return children_map
+
+def build_group_map(topology: Dict[str, NetworkNode]) -> Dict[str, List[NetworkNode]]:
+    """redundancy_group → メンバーノード一覧（トポロジーの定義順を保持）"""
+    group_map: Dict[str, List[NetworkNode]] = defaultdict(list)
+    for n in topology.values():
+        if n.redundancy_group:
+            group_map[n.redundancy_group].append(n)
+    return group_map
+
 # =====================================================
 # グローバル変数
 # =====================================================
 TOPOLOGY = load_topology_from_json()
+
+# TOPOLOGY の隣接インデックス（読み込み時に一度だけ構築。参照専用）
+CHILDREN_BY_PARENT = build_children_map(TOPOLOGY)
+NODES_BY_GROUP = build_group_map(TOPOLOGY)
@@ -1,8 +1,11 @@
 import json
 import os
 import re
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
 from enum import Enum
-from typing import List, Dict, Any, Optional
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Set
 
 import google.generativeai as genai
 
@@ -15,6 +18,109 @@ class HealthStatus(Enum):
     CRITICAL = "RED"
 
 
+# ==========================================================
+# Local safety rule keywords
+# ==========================================================
+# ルール判定に使う小文字キーワード（アラーム文字列1本を1回の走査で全キーワードに照合する）
+RULE_KEYWORDS = (
+    "power supply", "psu", "failed", "fail", "dual",
+    "fan", "high temperature", "overheat", "thermal",
+    "memory", "leak", "high",
+    "out of memory", "oom", "killed process", "kernel panic",
+)
+# 停止系（赤）の文言。大文字小文字を区別し、1回の検索でまとめて判定する
+# （"Power Supply: Dual Loss" は "Dual Loss" に含まれるので個別に持たない）
+_DEVICE_DOWN_RE = re.compile("Dual Loss|Device Down|Thermal Shutdown")
+
+# 上流断の症状（小文字化済みのメッセージに対して1回の検索で判定する）
+_CONNECTION_LOSS_RE = re.compile("connection lost|link down|port down|unreachable")
+
+# キーワードごとのビット（RULE_KEYWORDS の並び順で固定）
+_RULE_KEYWORD_BIT = {k: 1 << i for i, k in enumerate(RULE_KEYWORDS)}
+
+
+def _keyword_mask(*keywords: str) -> int:
+    mask = 0
+    for k in keywords:
+        mask |= _RULE_KEYWORD_BIT[k]
+    return mask
+
+
+# 同じ位置から始まる長いキーワードが一致したときに、短い方も一致したとみなす
+_RULE_KEYWORD_IMPLIES = tuple(
+    (_keyword_mask(longer), _keyword_mask(shorter))
+    for longer, shorter in (("failed", "fail"), ("high temperature", "high"))
+)
+# 先読みで全位置を走査（長いものを先に並べ、同じ位置では最長一致を拾う）
+_RULE_KEYWORD_RE = re.compile(
+    "(?=(" + "|".join(re.escape(k) for k in sorted(RULE_KEYWORDS, key=len, reverse=True)) + "))"
+)
+
+# ルールの条件表（ALL: すべて含む / ANY: いずれかを含む / NONE: いずれも含まない）
+RULE_PSU_NONE = _keyword_mask("dual")
+RULE_PSU_ALL = (_keyword_mask("power supply", "failed"), _keyword_mask("psu", "fail"))  # いずれかの組が成立
+RULE_FAN_ALL = _keyword_mask("fan", "fail")
+RULE_OVERHEAT_ANY = _keyword_mask("high temperature", "overheat", "thermal")
+RULE_MEMORY_ALL = _keyword_mask("memory")
+RULE_MEMORY_ANY = _keyword_mask("leak", "high")
+RULE_OOM_ANY = _keyword_mask("out of memory", "oom", "killed process", "kernel panic")
+
+
+def rule_keyword_mask(text_lower: str) -> int:
+    """text_lower に含まれる RULE_KEYWORDS のビットマスク"""
+    mask = 0
+    for m in _RULE_KEYWORD_RE.finditer(text_lower):
+        mask |= _RULE_KEYWORD_BIT[m.group(1)]
+    for longer, shorter in _RULE_KEYWORD_IMPLIES:
+        if mask & longer:
+            mask |= shorter
+    return mask
+
+
+def _has_all(mask: int, required: int) -> bool:
+    return mask & required == required
+
+
+# ==========================================================
+# Sanitization patterns
+# ==========================================================
+# 秘匿情報のマスク（4種類のパターンを1本にまとめ、1回の走査で置換する）
+_SANITIZE_RE = re.compile(
+    r'(?P<enc>encrypted-password\s+)"[^"]+"'
+    r"|(?P<user>username\s+\S+\s+secret)\s+\d\s+\S+"
+    r"|(?P<pw>password|secret)\s+(?P<pw_type>\d)\s+\S+"
+    r"|(?P<snmp>snmp-server community)\s+\S+"
+)
+
+
+def _mask_secret(m: "re.Match") -> str:
+    """_SANITIZE_RE の一致箇所を、一致したパターンに応じたマスク文字列に置き換える"""
+    kind = m.lastgroup
+    if kind == "enc":
+        return m.group("enc") + '"********"'
+    if kind == "user":
+        return m.group("user") + " 5 ********"
+    if kind == "pw_type":
+        return f"{m.group('pw')} {m.group('pw_type')} ********"
+    return m.group("snmp") + " ********"
+
+
+# ==========================================================
+# Background LLM worker
+# ==========================================================
+LLM_WORKERS = 4
+
+# LLM判定の待ち・失敗は一時的な結果なので、キャッシュせず次回に持ち越す
+LLM_PENDING = "AI_PENDING"
+LLM_ERROR = "AI_ERROR"
+
+
+@lru_cache(maxsize=1)
+def _llm_executor() -> ThreadPoolExecutor:
+    """全 LogicalRCA で共有するLLM呼び出し用スレッドプール（初回利用時に生成）"""
+    return ThreadPoolExecutor(max_workers=LLM_WORKERS, thread_name_prefix="logical-rca-llm")
+
+
 class LogicalRCA:
     """
     LogicalRCA (v5):
@@ -27,6 +133,11 @@ class LogicalRCA:
     SILENT_MIN_CHILDREN = 2
     SILENT_RATIO = 0.5
 
+    # 同一エビデンス（アラーム集合）に対する analyze 結果の保持件数
+    ANALYSIS_CACHE_SIZE = 32
+    # 機器単位の判定（analyze_redundancy_depth）結果の保持件数（LRU）
+    RCA_CACHE_SIZE = 1024
+
     def __init__(self, topology, config_dir: str = "./configs"):
         """
         :param topology: トポロジー辞書（device_id -> dict or NetworkNode） または JSONファイルパス(str)
@@ -42,9 +153,14 @@ class LogicalRCA:
         self.config_dir = config_dir
         self.model = None
         self._api_configured = False
+        self._analysis_cache: Dict[tuple, List[Dict[str, Any]]] = {}
+        self._rca_cache: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        # 判定キー -> バックグラウンドで実行中のLLM判定
+        self._llm_pending: Dict[tuple, Future] = {}
 
-        # parent -> [children...]
+        # parent -> [children...] / child -> parent（ノード形式の判定は構築時に一度だけ）
         self.children_map: Dict[str, List[str]] = {}
+        self.parent_map: Dict[str, Optional[str]] = {}
         for dev_id, info in self.topology.items():
             p = None
             if isinstance(info, dict):
@@ -56,6 +172,7 @@ class LogicalRCA:
                 elif hasattr(info, "paren"):
                     # data.py の __repr__ が paren... で出るが属性名は parent_id のはず。念のため。
                     p = getattr(info, "paren", None)
+            self.parent_map[dev_id] = p
             if p:
                 self.children_map.setdefault(p, []).append(dev_id)
 
@@ -66,12 +183,7 @@ class LogicalRCA:
         return self.topology.get(device_id, {})
 
     def _get_parent_id(self, device_id: str) -> Optional[str]:
-        info = self._get_device_info(device_id)
-        if isinstance(info, dict):
-            return info.get("parent_id")
-        if hasattr(info, "parent_id"):
-            return getattr(info, "parent_id")
-        return None
+        return self.parent_map.get(device_id)
 
     def _get_metadata(self, device_id: str) -> Dict[str, Any]:
         info = self._get_device_info(device_id)
@@ -134,8 +246,17 @@ class LogicalRCA:
         with open(path, "r", encoding="utf-8") as f:
             return json.load(f)
 
+    def _config_path(self, device_id: str) -> str:
+        return os.path.join(self.config_dir, f"{device_id}.txt")
+
+    def _config_mtime(self, device_id: str) -> Optional[float]:
+        try:
+            return os.path.getmtime(self._config_path(device_id))
+        except OSError:
+            return None
+
     def _read_config(self, device_id: str) -> str:
-        config_path = os.path.join(self.config_dir, f"{device_id}.txt")
+        config_path = self._config_path(device_id)
         if os.path.exists(config_path):
             try:
                 with open(config_path, "r", encoding="utf-8") as f:
@@ -148,27 +269,19 @@ class LogicalRCA:
     # Sanitization
     # ----------------------------
     def _sanitize_text(self, text: str) -> str:
-        text = re.sub(r'(encrypted-password\s+)"[^"]+"', r'\1"********"', text)
-        text = re.sub(r"(password|secret)\s+(\d)\s+\S+", r"\1 \2 ********", text)
-        text = re.sub(r"(username\s+\S+\s+secret)\s+\d\s+\S+", r"\1 5 ********", text)
-        text = re.sub(r"(snmp-server community)\s+\S+", r"\1 ********", text)
-        return text
+        return _SANITIZE_RE.sub(_mask_secret, text)
 
     # ==========================================================
     # Silent failure inference
     # ==========================================================
-    def _is_connection_loss(self, msg: str) -> bool:
-        msg_l = msg.lower()
-        return (
-            "connection lost" in msg_l
-            or "link down" in msg_l
-            or "port down" in msg_l
-            or "unreachable" in msg_l
-        )
+    def _is_connection_loss(self, msg_l: str) -> bool:
+        """msg_l は小文字化済みのメッセージ"""
+        return _CONNECTION_LOSS_RE.search(msg_l) is not None
 
-    def _detect_silent_failures(self, msg_map: Dict[str, List[str]]) -> Dict[str, Dict[str, Any]]:
+    def _detect_silent_failures(self, msg_map: Dict[str, List[str]], conn_lost_ids: Set[str]) -> Dict[str, Dict[str, Any]]:
         """
         親自身にアラームが無いのに、配下の複数子が Connection Lost を出しているなら親を疑う。
+        conn_lost_ids は Connection Lost 系のメッセージを持つ機器ID。
         """
         suspects: Dict[str, Dict[str, Any]] = {}
 
@@ -178,11 +291,7 @@ class LogicalRCA:
             if parent_id in msg_map:
                 continue
 
-            affected = []
-            for c in children:
-                msgs = msg_map.get(c, [])
-                if any(self._is_connection_loss(m) for m in msgs):
-                    affected.append(c)
+            affected = [c for c in children if c in conn_lost_ids]
 
             if not affected:
                 continue
@@ -226,16 +335,56 @@ class LogicalRCA:
                 "reason": "No active alerts detected."
             }]
 
-        msg_map: Dict[str, List[str]] = {}
+        # setdefault と違い、アラームごとに空リストを作らない
+        msg_map: Dict[str, List[str]] = defaultdict(list)
+        lc_map: Dict[str, List[str]] = defaultdict(list)  # Alarm 生成時に作った小文字形
         for a in alarms:
-            msg_map.setdefault(a.device_id, []).append(a.message)
+            msg_map[a.device_id].append(a.message)
+            lc_map[a.device_id].append(a.message_lc)
+
+        # エビデンス一式をまとめて1回だけ推論する（再実行のたびに機器ごとのLLM判定を繰り返さない）
+        # LLM判定はコンフィグを参照するので、各機器のコンフィグ更新時刻もキーに含める
+        evidence_key = (
+            tuple((dev, tuple(msgs), self._config_mtime(dev)) for dev, msgs in msg_map.items()),
+            self.SILENT_MIN_CHILDREN,
+            self.SILENT_RATIO,
+            bool(os.environ.get("GOOGLE_API_KEY")),
+        )
+        cached = self._analysis_cache.get(evidence_key)
+        if cached is None:
+            cached = self._analyze_evidence(msg_map, lc_map)
+            # LLM判定待ち・一時的な失敗を含む結果は保持しない（次回の analyze で確定結果を拾う／再試行する）
+            if any(r.get("type") in (LLM_PENDING, LLM_ERROR) for r in cached):
+                return [dict(r) for r in cached]
+            if len(self._analysis_cache) >= self.ANALYSIS_CACHE_SIZE:
+                self._analysis_cache.pop(next(iter(self._analysis_cache)))
+            self._analysis_cache[evidence_key] = cached
+        # 呼び出し側が prob 等を書き換えるため、候補ごとにコピーして返す
+        return [dict(r) for r in cached]
+
+    def _analyze_evidence(self, msg_map: Dict[str, List[str]], lc_map: Dict[str, List[str]]) -> List[Dict[str, Any]]:
+        # 小文字形のメッセージで機器を分類し、以降は機器IDの集合で判定する
+        conn_lost_ids: Set[str] = set()
+        unreachable_ids: Set[str] = set()
+
+        def classify(dev: str, lowered: List[str]) -> None:
+            # 機器のメッセージをまとめて1回ずつ検索（キーワードは改行をまたがない）
+            text = "\n".join(lowered)
+            if self._is_connection_loss(text):
+                conn_lost_ids.add(dev)
+            if "unreachable" in text:
+                unreachable_ids.add(dev)
+
+        for dev, lowered in lc_map.items():
+            classify(dev, lowered)
 
         # サイレント推定
-        silent_suspects = self._detect_silent_failures(msg_map)
+        silent_suspects = self._detect_silent_failures(msg_map, conn_lost_ids)
 
         # 親を分析対象に追加（疑似アラーム）
         for parent_id, info in silent_suspects.items():
             msg_map.setdefault(parent_id, []).append("Silent Failure Suspected (Derived from child Connection Lost)")
+            classify(parent_id, [m.lower() for m in msg_map[parent_id]])
 
         alarmed_ids = set(msg_map.keys())
 
@@ -252,7 +401,7 @@ class LogicalRCA:
         for device_id, messages in msg_map.items():
 
             # サイレント疑い配下の子は被疑（症状）扱い
-            if parent_is_silent_suspect(device_id) and any(self._is_connection_loss(m) for m in messages):
+            if parent_is_silent_suspect(device_id) and device_id in conn_lost_ids:
                 p = self._get_parent_id(device_id)
                 results.append({
                     "id": device_id,
@@ -265,7 +414,7 @@ class LogicalRCA:
                 continue
 
             # 通常のカスケード抑制
-            if any("unreachable" in m.lower() for m in messages) and parent_is_alarmed(device_id):
+            if device_id in unreachable_ids and parent_is_alarmed(device_id):
                 p = self._get_parent_id(device_id)
                 results.append({
                     "id": device_id,
@@ -340,6 +489,31 @@ class LogicalRCA:
         # 将来、インベントリ＋過去の証跡が十分に利用できるようになったら、
         # この判断はAIに委譲すべきです。
         """
+        # 同じ機器・同じアラート集合の判定は使い回す（LLM経路はコンフィグ更新・APIキー有無でも無効化）
+        key = (
+            device_id,
+            tuple(sorted(alerts)),
+            self._config_mtime(device_id),
+            bool(os.environ.get("GOOGLE_API_KEY")),
+        )
+        cached = self._rca_cache.get(key)
+        if cached is not None:
+            self._rca_cache.move_to_end(key)
+            return dict(cached)
+
+        result = self._analyze_redundancy_depth(device_id, alerts, key)
+        # LLM判定待ち・一時的なAI呼び出し失敗は次回再評価させるため保持しない
+        if result.get("impact_type") not in (LLM_PENDING, LLM_ERROR):
+            self._rca_cache[key] = result
+            if len(self._rca_cache) > self.RCA_CACHE_SIZE:
+                self._rca_cache.popitem(last=False)
+        return dict(result)
+
+    def has_pending_llm(self) -> bool:
+        """バックグラウンドで実行中のLLM判定があるか"""
+        return any(not f.done() for f in self._llm_pending.values())
+
+    def _analyze_redundancy_depth(self, device_id: str, alerts: List[str], key: tuple) -> Dict[str, Any]:
         if not alerts:
             return {"status": HealthStatus.NORMAL, "reason": "No active alerts detected.", "impact_type": "NONE"}
 
@@ -348,28 +522,32 @@ class LogicalRCA:
         joined_lower = joined.lower()
 
         # 0) 停止系（赤）
-        if ("Power Supply: Dual Loss" in joined) or ("Dual Loss" in joined) or ("Device Down" in joined) or ("Thermal Shutdown" in joined):
+        if _DEVICE_DOWN_RE.search(joined):
             return {"status": HealthStatus.CRITICAL, "reason": "Device down / dual PSU loss / thermal shutdown detected (local safety rule).", "impact_type": "Hardware/Physical"}
 
+        # 以降のキーワード判定は1回の走査で得たビットマスクと条件表の比較で行う
+        hits = rule_keyword_mask(joined_lower)
+
         # 1) 電源片系（黄色/赤）
         psu_count = self._get_psu_count(device_id, default=1)
-        psu_single_fail = ("power supply" in joined_lower and "failed" in joined_lower and "dual" not in joined_lower) or ("psu" in joined_lower and "fail" in joined_lower and "dual" not in joined_lower)
+        psu_single_fail = not (hits & RULE_PSU_NONE) and any(_has_all(hits, req) for req in RULE_PSU_ALL)
         if psu_single_fail:
             if psu_count >= 2:
                 return {"status": HealthStatus.WARNING, "reason": f"Single PSU failure with redundancy (psu_count={psu_count}) (local safety rule).", "impact_type": "Hardware/Redundancy"}
             return {"status": HealthStatus.CRITICAL, "reason": f"Single PSU failure without redundancy (psu_count={psu_count}) (local safety rule).", "impact_type": "Hardware/Physical"}
 
         # 2) FAN（黄色 / 熱兆候で赤）
-        fan_fail = ("fan fail" in joined_lower) or ("fan" in joined_lower and "fail" in joined_lower)
-        overheat_hint = ("high temperature" in joined_lower) or ("overheat" in joined_lower) or ("thermal" in joined_lower)
+        # "fan fail" は "fan" と "fail" の両方を含むので個別の判定で足りる
+        fan_fail = _has_all(hits, RULE_FAN_ALL)
+        overheat_hint = bool(hits & RULE_OVERHEAT_ANY)
         if fan_fail:
             if overheat_hint:
                 return {"status": HealthStatus.CRITICAL, "reason": "Fan failure with overheat/thermal symptom detected (local safety rule).", "impact_type": "Hardware/Physical"}
             return {"status": HealthStatus.WARNING, "reason": "Fan failure detected. Service likely continues but risk of thermal escalation (local safety rule).", "impact_type": "Hardware/Degraded"}
 
         # 3) メモリ（黄色 / OOMで赤）
-        mem_symptom = ("memory high" in joined_lower) or ("memory leak" in joined_lower) or ("memory" in joined_lower and ("leak" in joined_lower or "high" in joined_lower))
-        oom_hint = ("out of memory" in joined_lower) or ("oom" in joined_lower) or ("killed process" in joined_lower) or ("kernel panic" in joined_lower)
+        mem_symptom = _has_all(hits, RULE_MEMORY_ALL) and bool(hits & RULE_MEMORY_ANY)
+        oom_hint = bool(hits & RULE_OOM_ANY)
         if mem_symptom:
             if oom_hint:
                 return {"status": HealthStatus.CRITICAL, "reason": "Memory leak/high with OOM/crash symptom detected (local safety rule).", "impact_type": "Software/Resource"}
@@ -379,10 +557,21 @@ class LogicalRCA:
         if not self._ensure_api_configured():
             return {"status": HealthStatus.WARNING, "reason": "API key not configured. Manual analysis required.", "impact_type": "UNKNOWN"}
 
+        # LLM呼び出しは解析ループの外（スレッドプール）で行い、完了までは暫定判定を返す
+        future = self._llm_pending.get(key)
+        if future is None:
+            prompt = self._build_llm_prompt(device_id, safe_alerts)
+            self._llm_pending[key] = future = _llm_executor().submit(self._llm_verdict, prompt)
+        if not future.done():
+            return {"status": HealthStatus.WARNING, "reason": "AI analysis in progress. Provisional verdict until it completes.", "impact_type": LLM_PENDING}
+        del self._llm_pending[key]
+        return future.result()
+
+    def _build_llm_prompt(self, device_id: str, safe_alerts: List[str]) -> str:
         metadata = self._get_metadata(device_id)
         safe_config = self._sanitize_text(self._read_config(device_id))
 
-        prompt = f"""
+        return f"""
 あなたはネットワーク運用のエキスパートAIです。
 以下の情報に基づき、現在発生しているアラートが「サービス停止(CRITICAL)」を引き起こしているか、
 それとも「冗長機能によりサービスは維持されている(WARNING)」状態かを判定してください。
@@ -410,6 +599,8 @@ class LogicalRCA:
 }}
 """
 
+    def _llm_verdict(self, prompt: str) -> Dict[str, Any]:
+        """ワーカースレッドで実行される。例外は AI_ERROR の判定として返す"""
         try:
             response = self.model.generate_content(prompt, generation_config={"response_mime_type": "application/json"})
             response_text = response.text.strip()
@@ -431,4 +622,4 @@ class LogicalRCA:
 
         except Exception as e:
             print(f"[!] AI Inference Error: {e}")
-            return {"status": HealthStatus.WARNING, "reason": f"AI Analysis Failed: {str(e)}", "impact_type": "AI_ERROR"}
+            return {"status": HealthStatus.WARNING, "reason": f"AI Analysis Failed: {str(e)}", "impact_type": LLM_ERROR}
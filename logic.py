@@ -5,9 +5,11 @@ Google Antigravity AIOps Agent - Logic Module (Optimized Final)
 """
 
 import logging
+import sys
+from collections import defaultdict, deque
 from typing import List, Dict, Set, Optional
 from dataclasses import dataclass, field
-from data import TOPOLOGY, NetworkNode
+from data import TOPOLOGY, NetworkNode, CHILDREN_BY_PARENT, NODES_BY_GROUP, build_children_map, build_group_map
 
 # =====================================================
 # ロギング設定
@@ -18,7 +20,10 @@ logger = logging.getLogger(__name__)
 # データクラス定義
 # =====================================================
 
-@dataclass
+# アラームの重要度（値は正規化後の定数文字列）
+ALARM_SEVERITIES = {s: s for s in ("CRITICAL", "WARNING", "INFO")}
+
+@dataclass(slots=True)
 class Alarm:
     """
     ネットワークアラームを表現するデータクラス
@@ -27,19 +32,26 @@ class Alarm:
     message: str
     severity: str  # CRITICAL, WARNING, INFO
     timestamp: Optional[float] = None
+    message_lc: str = field(init=False, repr=False, compare=False)  # message の小文字形
     
     def __post_init__(self):
         """バリデーション"""
-        valid_severities = {"CRITICAL", "WARNING", "INFO"}
-        if self.severity not in valid_severities:
+        if self.severity not in ALARM_SEVERITIES:
             logger.warning(
                 f"Invalid severity '{self.severity}' for alarm {self.device_id}. "
-                f"Valid values: {valid_severities}. Defaulting to 'WARNING'."
+                f"Valid values: {set(ALARM_SEVERITIES)}. Defaulting to 'WARNING'."
             )
             self.severity = "WARNING"
+        else:
+            # 定数の文字列オブジェクトに揃える（比較が同一性チェックで済む）
+            self.severity = ALARM_SEVERITIES[self.severity]
         
         if not self.device_id or not isinstance(self.device_id, str):
             raise ValueError(f"Invalid device_id: {self.device_id}")
+        
+        # メッセージは語彙が限られるので intern して共有し、小文字形も生成時に一度だけ作る
+        self.message = sys.intern(str(self.message))
+        self.message_lc = self.message.lower()
 
 @dataclass
 class InferenceResult:
@@ -76,6 +88,16 @@ class CausalInferenceEngine:
             raise ValueError("Topology cannot be empty")
         
         self.topology = topology
+        # 親→子、HAグループ→メンバーの対応を一度だけ構築（解析ごとの全ノード走査を避ける）
+        # data.TOPOLOGY なら読み込み時に構築済みのものを共有する
+        if topology is TOPOLOGY:
+            self.children_map = CHILDREN_BY_PARENT
+            self.redundancy_groups = NODES_BY_GROUP
+        else:
+            self.children_map = build_children_map(topology)
+            self.redundancy_groups = build_group_map(topology)
+        # device_id → layer（アラームの並べ替えキーを dict.get 1回で引く）
+        self._layer: Dict[str, int] = {nid: n.layer for nid, n in topology.items()}
         logger.info(f"CausalInferenceEngine initialized with {len(topology)} nodes")
     
     def analyze_alarms(self, alarms: List[Alarm]) -> InferenceResult:
@@ -96,21 +118,14 @@ class CausalInferenceEngine:
                 severity="INFO"
             )
         
-        # アラーム情報の整理
-        alarmed_device_ids = {a.device_id for a in alarms}
+        # アラーム情報の整理（ID集合は辞書のキービューをそのまま使う）
         alarm_map = {a.device_id: a for a in alarms}
+        alarmed_device_ids = alarm_map.keys()
         
-        # 階層順にソート（layer値が小さいほど上位層）
-        sorted_alarms = sorted(
-            alarms,
-            key=lambda a: (
-                self.topology[a.device_id].layer 
-                if a.device_id in self.topology 
-                else 999
-            )
-        )
-        
-        top_alarm = sorted_alarms[0]
+        # 最上位層のアラーム（layer値が小さいほど上位層。同順位は先に来たもの）
+        # 使うのは先頭だけなので全体はソートしない
+        layer_of = self._layer.get
+        top_alarm = min(alarms, key=lambda a: layer_of(a.device_id, 999))
         top_node = self.topology.get(top_alarm.device_id)
         
         # トポロジーに存在しないデバイス
@@ -159,10 +174,7 @@ class CausalInferenceEngine:
         alarm_map: Dict[str, Alarm]
     ) -> InferenceResult:
         """冗長性構成（HA）の分析"""
-        group_members = [
-            n for n in self.topology.values() 
-            if n.redundancy_group == node.redundancy_group
-        ]
+        group_members = self.redundancy_groups.get(node.redundancy_group, [])
         down_members = [n for n in group_members if n.id in alarmed_ids]
         
         # エラー詳細の構築
@@ -206,7 +218,7 @@ class CausalInferenceEngine:
         parent_node = self.topology.get(parent_id)
         if not parent_node: return None
         
-        children = [n for n in self.topology.values() if n.parent_id == parent_id]
+        children = self.children_map.get(parent_id)
         if not children: return None
         
         children_down = sum(1 for c in children if c.id in alarmed_ids)
@@ -228,12 +240,31 @@ class CausalInferenceEngine:
 # ユーティリティ関数
 # =====================================================
 
+def _build_children_ids(topology: Dict[str, NetworkNode]) -> Dict[str, List[str]]:
+    """parent_id → 子ノードID一覧（simulate_cascade_failure 用の隣接リスト）"""
+    children_ids: Dict[str, List[str]] = defaultdict(list)
+    for n in topology.values():
+        if n.parent_id:
+            children_ids[n.parent_id].append(n.id)
+    return children_ids
+
+# data.TOPOLOGY 用の隣接リスト（ID版）はインポート時に一度だけ作る
+_TOPOLOGY_CHILDREN_IDS = {
+    parent_id: [n.id for n in children] for parent_id, children in CHILDREN_BY_PARENT.items()
+}
+
 def simulate_cascade_failure(
     root_cause_id: str, 
     topology: Dict[str, NetworkNode], 
-    custom_message: str = "Interface Down"
+    custom_message: str = "Interface Down",
+    children_of: Optional[Dict[str, List[str]]] = None
 ) -> List[Alarm]:
-    """カスケード障害のシミュレーション"""
+    """
+    カスケード障害のシミュレーション
+    
+    children_of（parent_id → 子ノードID一覧）を渡すと、
+    トポロジーからの隣接リスト構築を省略する。
+    """
     if root_cause_id not in topology:
         raise ValueError(f"Device {root_cause_id} not found in topology")
     
@@ -244,22 +275,20 @@ def simulate_cascade_failure(
     generated_alarms.append(root_alarm)
     
     # BFSで子デバイスを探索
-    queue = [root_cause_id]
+    if children_of is None:
+        children_of = _TOPOLOGY_CHILDREN_IDS if topology is TOPOLOGY else _build_children_ids(topology)
+    queue = deque([root_cause_id])
     processed = {root_cause_id}
     
     while queue:
-        current_parent_id = queue.pop(0)
-        children = [
-            n for n in topology.values() 
-            if n.parent_id == current_parent_id
-        ]
+        current_parent_id = queue.popleft()
         
-        for child in children:
-            if child.id not in processed:
-                child_alarm = Alarm(child.id, "Unreachable", "WARNING")
+        for child_id in children_of.get(current_parent_id, ()):
+            if child_id not in processed:
+                child_alarm = Alarm(child_id, "Unreachable", "WARNING")
                 generated_alarms.append(child_alarm)
-                queue.append(child.id)
-                processed.add(child.id)
+                queue.append(child_id)
+                processed.add(child_id)
                 
     return generated_alarms
 
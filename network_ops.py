@@ -5,8 +5,51 @@ import re
 import os
 import time
 import json
+import hashlib
+import threading
+from collections import OrderedDict
 import google.generativeai as genai
-from netmiko import ConnectHandler
+from google.generativeai import client as genai_client
+
+MODEL_NAME = "gemma-3-12b-it"
+
+# genai.configure はモジュール全体の設定なので、切り替えとクライアント生成はこのロック内で行う
+_CONFIGURE_LOCK = threading.Lock()
+
+def api_key_hash(api_key: str) -> str:
+    """キャッシュキー用の API Key ハッシュ（キー自体はキャッシュキーに残さない）"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+def build_model_for_key(api_key: str, model_name: str = MODEL_NAME, generation_config=None) -> genai.GenerativeModel:
+    """
+    api_key に固定した生成モデルを作る
+    GenerativeModel はクライアントを初回呼び出し時にグローバル設定から作って以後使い続けるため、
+    指定キーで configure した直後にクライアントを束縛しておく（後から別キーで configure されても影響を受けない）
+    """
+    with _CONFIGURE_LOCK:
+        genai.configure(api_key=api_key)
+        model = genai.GenerativeModel(model_name, generation_config=generation_config)
+        model._client = genai_client.get_default_generative_client()
+    return model
+
+MODEL_CACHE_SIZE = 16
+_models: "OrderedDict[tuple, genai.GenerativeModel]" = OrderedDict()
+_models_lock = threading.Lock()
+
+def _get_model(api_key, temperature=0.0):
+    """生成モデルを取得（同じ API Key・temperature のインスタンスはプロセス内で共有）"""
+    key = (api_key_hash(api_key), temperature)
+    with _models_lock:
+        model = _models.get(key)
+        if model is not None:
+            _models.move_to_end(key)
+            return model
+    model = build_model_for_key(api_key, generation_config={"temperature": temperature})
+    with _models_lock:
+        _models[key] = model
+        while len(_models) > MODEL_CACHE_SIZE:
+            _models.popitem(last=False)
+    return model
 
 SANDBOX_DEVICE = {
     'device_type': 'cisco_nxos',
@@ -32,18 +75,21 @@ def sanitize_output(text: str) -> str:
         text = re.sub(pattern, replacement, text)
     return text
 
-def generate_fake_log_by_ai(scenario_name, target_node, api_key):
+def sanitize_stream(chunks):
     """
-    シナリオ名と機器メタデータから、AIが自律的に障害ログを生成する
+    ストリーム出力を行単位でサニタイズしながら返す
+    （マスク対象のパターンは全て1行内で完結するため、行が揃ってから適用する）
     """
-    if not api_key: return "Error: API Key Missing"
-    
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel(
-        "gemma-3-12b-it",
-        generation_config={"temperature": 0.2}
-    )
-    
+    buffer = ""
+    for chunk in chunks:
+        buffer += chunk
+        if "\n" in buffer:
+            complete, buffer = buffer.rsplit("\n", 1)
+            yield sanitize_output(complete + "\n")
+    if buffer:
+        yield sanitize_output(buffer)
+
+def _build_fake_log_prompt(scenario_name, target_node):
     # ノード情報（JSONから取得）
     vendor = target_node.metadata.get("vendor", "Generic")
     os_type = target_node.metadata.get("os", "Generic OS")
@@ -73,6 +119,16 @@ def generate_fake_log_by_ai(scenario_name, target_node, api_key):
     解説不要。CLIのテキストデータのみを出力してください。
     Markdownのコードブロックは使用しないでください（生テキストで出力）。
     """
+    return prompt
+
+def generate_fake_log_by_ai(scenario_name, target_node, api_key):
+    """
+    シナリオ名と機器メタデータから、AIが自律的に障害ログを生成する
+    """
+    if not api_key: return "Error: API Key Missing"
+    
+    model = _get_model(api_key, temperature=0.2)
+    prompt = _build_fake_log_prompt(scenario_name, target_node)
     
     try:
         response = model.generate_content(prompt)
@@ -80,10 +136,62 @@ def generate_fake_log_by_ai(scenario_name, target_node, api_key):
     except Exception as e:
         return f"AI Generation Error: {e}"
 
+class LogGenerationError(RuntimeError):
+    """AI生成ログのストリームが再試行しても完了しなかった"""
+
+STREAM_MAX_ATTEMPTS = 3
+
+def generate_fake_log_by_ai_stream(scenario_name, target_node, api_key):
+    """
+    generate_fake_log_by_ai のストリーミング版（チャンクごとにテキストを yield）
+    
+    ストリーム途中で失敗した場合は、表示済みの部分をプロンプトに添えて続きから再生成する。
+    STREAM_MAX_ATTEMPTS 回失敗したら LogGenerationError を送出する（途中までのログを成功扱いにしない）。
+    """
+    if not api_key:
+        yield "Error: API Key Missing"
+        return
+    
+    model = _get_model(api_key, temperature=0.2)
+    prompt = _build_fake_log_prompt(scenario_name, target_node)
+    
+    received = ""  # 表示済みのテキスト
+    for attempt in range(STREAM_MAX_ATTEMPTS):
+        request = prompt
+        if received:
+            request += (
+                "\n\n以下は既に出力済みのログです。この直後から続きだけを出力してください"
+                "（出力済みの部分は繰り返さないこと）。\n"
+                f"{received}"
+            )
+        try:
+            for chunk in model.generate_content(request, stream=True):
+                text = chunk.text
+                received += text
+                yield text
+            return
+        except Exception as e:
+            if attempt == STREAM_MAX_ATTEMPTS - 1:
+                raise LogGenerationError(f"AI Generation Error: {e}") from e
+            time.sleep(1.0 * (attempt + 1))
+
+def _diagnostic_mode(scenario_type):
+    """シナリオの診断方法: "skip"（不要） / "live"（実機） / "timeout"（到達不能） / "ai"（AI生成ログ）"""
+    if "---" in scenario_type or "正常" in scenario_type:
+        return "skip"
+    if "[Live]" in scenario_type:
+        return "live"
+    if "全回線断" in scenario_type or "サイレント" in scenario_type or "両系" in scenario_type:
+        return "timeout"
+    return "ai"
+
+def uses_ai_generated_log(scenario_type):
+    """run_diagnostic_simulation が AI 生成ログで診断するシナリオかどうか"""
+    return _diagnostic_mode(scenario_type) == "ai"
+
 def generate_config_from_intent(target_node, current_config, intent_text, api_key):
     if not api_key: return "Error: API Key Missing"
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel("gemma-3-12b-it", generation_config={"temperature": 0.0})
+    model = _get_model(api_key)
     
     vendor = target_node.metadata.get("vendor", "Unknown Vendor")
     os_type = target_node.metadata.get("os", "Unknown OS")
@@ -103,8 +211,7 @@ def generate_config_from_intent(target_node, current_config, intent_text, api_ke
 
 def generate_health_check_commands(target_node, api_key):
     if not api_key: return "Error: API Key Missing"
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel("gemma-3-12b-it", generation_config={"temperature": 0.0})
+    model = _get_model(api_key)
     
     vendor = target_node.metadata.get("vendor", "Unknown Vendor")
     os_type = target_node.metadata.get("os", "Unknown OS")
@@ -121,8 +228,7 @@ def generate_remediation_commands(scenario, analysis_result, target_node, api_ke
     障害シナリオと分析結果に基づき、復旧手順（物理対応＋コマンド＋確認）を生成する
     """
     if not api_key: return "Error: API Key Missing"
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel("gemma-3-12b-it", generation_config={"temperature": 0.0})
+    model = _get_model(api_key)
     
     prompt = f"""
     あなたは熟練したネットワークエンジニアです。
@@ -157,13 +263,16 @@ def generate_remediation_commands(scenario, analysis_result, target_node, api_ke
 
 def run_diagnostic_simulation(scenario_type, target_node=None, api_key=None):
     time.sleep(1.5)
+    mode = _diagnostic_mode(scenario_type)
     
-    if "---" in scenario_type or "正常" in scenario_type:
+    if mode == "skip":
         return {"status": "SKIPPED", "sanitized_log": "No action required.", "error": None}
 
-    if "[Live]" in scenario_type:
+    if mode == "live":
         commands = ["terminal length 0", "show version", "show interface brief", "show ip route"]
         try:
+            # netmiko (paramiko) は重いので実機診断時のみ読み込む
+            from netmiko import ConnectHandler
             with ConnectHandler(**SANDBOX_DEVICE) as ssh:
                 if not ssh.check_enable_mode(): ssh.enable()
                 prompt = ssh.find_prompt()
@@ -175,10 +284,10 @@ def run_diagnostic_simulation(scenario_type, target_node=None, api_key=None):
             return {"status": "ERROR", "sanitized_log": "", "error": str(e)}
         return {"status": "SUCCESS", "sanitized_log": sanitize_output(raw_output), "error": None}
             
-    elif "全回線断" in scenario_type or "サイレント" in scenario_type or "両系" in scenario_type:
+    elif mode == "timeout":
         return {"status": "ERROR", "sanitized_log": "", "error": "Connection timed out"}
 
-    else:
+    else:  # uses_ai_generated_log(scenario_type)
         if api_key and target_node:
             raw_output = generate_fake_log_by_ai(scenario_type, target_node, api_key)
             return {"status": "SUCCESS", "sanitized_log": sanitize_output(raw_output), "error": None}
@@ -192,8 +301,7 @@ def predict_initial_symptoms(scenario_name, api_key):
     """
     if not api_key: return {}
     
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel("gemma-3-12b-it", generation_config={"temperature": 0.0})
+    model = _get_model(api_key)
     
     prompt = f"""
     あなたはネットワーク監視システムのAIエージェントです。
@@ -9,14 +9,17 @@ Canonical layout:
 This module centralizes:
 - tenant/network discovery
 - topology path + config dir resolution
-- topology loading
+- topology loading (parsed topologies are cached per (path, mtime))
 """
 
 from __future__ import annotations
 
+import os
+import time
 from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
 from data import load_topology_from_json, NetworkNode
 
@@ -38,25 +41,55 @@ def _tenants_root() -> Path:
 
 
 def list_tenants() -> List[str]:
-    troot = _tenants_root()
-    if not troot.exists():
-        return ["A", "B"]
-    tenants = sorted([p.name for p in troot.iterdir() if p.is_dir() and not p.name.startswith(".")])
-    return tenants or ["A", "B"]
+    # Served from the cached list_scopes() walk (same ordering and fallbacks)
+    return list(dict.fromkeys(p.tenant_id for p in list_scopes()))
 
 
 def list_networks(tenant_id: str) -> List[str]:
-    nroot = _tenants_root() / tenant_id / "networks"
-    if not nroot.exists():
-        return ["default"]
-    nets = sorted([p.name for p in nroot.iterdir() if p.is_dir() and not p.name.startswith(".")])
+    nets = [p.network_id for p in list_scopes() if p.tenant_id == tenant_id]
     return nets or ["default"]
 
 
+SCOPE_SCAN_TTL = 30.0  # seconds
+
+
+def _subdirs(path: Path) -> List[str]:
+    try:
+        with os.scandir(path) as it:
+            return sorted(e.name for e in it if e.is_dir() and not e.name.startswith("."))
+    except FileNotFoundError:
+        return []
+
+
+@lru_cache(maxsize=4)
+def _scan_scopes(root_mtime_ns: int, ttl_bucket: int) -> Tuple[TenantNetworkPaths, ...]:
+    troot = _tenants_root()
+    scopes = []
+    for t in _subdirs(troot) or ["A", "B"]:
+        for n in _subdirs(troot / t / "networks") or ["default"]:
+            scopes.append(get_paths(t, n))
+    return tuple(scopes)
+
+
+def list_scopes() -> Tuple[TenantNetworkPaths, ...]:
+    """
+    All (tenant, network) scopes in one scandir walk, same ordering and
+    fallbacks as list_tenants() x list_networks(). Cached until the tenants
+    root changes; new networks inside an existing tenant show up within
+    SCOPE_SCAN_TTL seconds.
+    """
+    try:
+        root_mtime_ns = _tenants_root().stat().st_mtime_ns
+    except FileNotFoundError:
+        root_mtime_ns = 0
+    return _scan_scopes(root_mtime_ns, int(time.monotonic() // SCOPE_SCAN_TTL))
+
+
+@lru_cache(maxsize=1024)
 def get_paths(tenant_id: str, network_id: str) -> TenantNetworkPaths:
-    topo = _tenants_root() / tenant_id / "networks" / network_id / "topology.json"
-    cfg = _tenants_root() / tenant_id / "networks" / network_id / "configs"
-    return TenantNetworkPaths(tenant_id, network_id, topo, cfg)
+    # Pure path arithmetic; the frozen result is safe to share
+    base = _tenants_root() / tenant_id / "networks" / network_id
+    return TenantNetworkPaths(tenant_id, network_id, base / "topology.json", base / "configs")
 
 
 def topology_mtime(path: Path) -> float:
@@ -67,4 +100,15 @@ def topology_mtime(path: Path) -> float:
 
 
 def load_topology(topology_path: Path) -> Dict[str, NetworkNode]:
+    """Uncached (fresh, mutable) load. Read-only callers should use load_topology_cached()."""
     return load_topology_from_json(str(topology_path))
+
+
+@lru_cache(maxsize=256)
+def _load_topology_cached(path: str, mtime: float) -> Dict[str, NetworkNode]:
+    return load_topology_from_json(path)
+
+
+def load_topology_cached(topology_path: Path) -> Dict[str, NetworkNode]:
+    """Cached load_topology. Returns the same dict until the file changes; do not mutate it."""
+    return _load_topology_cached(str(topology_path), topology_mtime(topology_path))
@@ -8,6 +8,7 @@ safety_rules.py - Safety-Criticalな判定ルールの集約
 - inference_engine.pyの設計思想を全体に適用
 """
 
+import re
 from typing import List, Dict, Any, Optional
 from dataclasses import dataclass
 from enum import Enum
@@ -33,6 +34,22 @@ class ImpactType(Enum):
     UNKNOWN = "UNKNOWN"
 
 
+# ========================================
+# キーワード分類ごとのパターン
+# ========================================
+
+def _keyword_pattern(*keywords: str) -> "re.Pattern":
+    """いずれかのキーワードを含むかを1回の検索で判定するパターン（大文字小文字を区別しない）"""
+    return re.compile("|".join(re.escape(k) for k in keywords), re.IGNORECASE)
+
+
+_RE_PSU_FAIL = _keyword_pattern("power supply", "psu fail", "psu 1 fail", "電源障害")
+_RE_FAN_FAIL = _keyword_pattern("fan fail", "fan fault", "ファン故障")
+_RE_THERMAL = _keyword_pattern("high temperature", "overheat", "thermal", "高温")
+_RE_MEM_HIGH = _keyword_pattern("memory high", "memory leak", "メモリリーク", "メモリ高")
+_RE_OOM = _keyword_pattern("out of memory", "oom", "kernel panic", "process killed")
+
+
 # ========================================
 # データクラス
 # ========================================
@@ -128,12 +145,10 @@ class SafetyRuleEngine:
         - PSU 1台 + 故障 → CRITICAL（停止リスク）
         - Dual Loss → CRITICAL（即座に停止）
         """
-        joined = " ".join(alarms).lower()
+        joined = " ".join(alarms)
         
         # Dual Loss は既に check_outage で判定済みなので、ここでは単一故障のみ
-        psu_fail = any(kw in joined for kw in [
-            "power supply", "psu fail", "psu 1 fail", "電源障害"
-        ])
+        psu_fail = bool(_RE_PSU_FAIL.search(joined))
         
         if not psu_fail:
             return None
@@ -201,12 +216,10 @@ class SafetyRuleEngine:
         - FAN故障 + 熱警告 → CRITICAL（停止リスク）
         - FAN故障のみ → WARNING（監視強化）
         """
-        joined = " ".join(alarms).lower()
+        joined = " ".join(alarms)
         
-        fan_fail = any(kw in joined for kw in ["fan fail", "fan fault", "ファン故障"])
-        thermal_symptom = any(kw in joined for kw in [
-            "high temperature", "overheat", "thermal", "高温"
-        ])
+        fan_fail = bool(_RE_FAN_FAIL.search(joined))
+        thermal_symptom = bool(_RE_THERMAL.search(joined))
         
         if fan_fail and thermal_symptom:
             return SafetyJudgment(
@@ -238,14 +251,10 @@ class SafetyRuleEngine:
         - メモリ高 + OOM/クラッシュ → CRITICAL
         - メモリ高のみ → WARNING
         """
-        joined = " ".join(alarms).lower()
+        joined = " ".join(alarms)
         
-        mem_high = any(kw in joined for kw in [
-            "memory high", "memory leak", "メモリリーク", "メモリ高"
-        ])
-        oom = any(kw in joined for kw in [
-            "out of memory", "oom", "kernel panic", "process killed"
-        ])
+        mem_high = bool(_RE_MEM_HIGH.search(joined))
+        oom = bool(_RE_OOM.search(joined))
         
         if mem_high and oom:
             return SafetyJudgment(
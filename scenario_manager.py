@@ -169,6 +169,19 @@ class ScenarioCatalog:
         results = catalog.search("WAN全回線断")
         best_match = results[0] if results else None
         """
+        if top_k == 1:
+            # 1件だけ欲しい場合はソートせず最高点を保持する。
+            # スコアの上限は ID完全一致の 1.0 なので、出た時点で以降の走査を打ち切る
+            # （同点は先に定義されたシナリオを優先。ソート版と同じ結果）
+            best, best_score = None, 0.0
+            for s in self.scenarios:
+                score = s.matches(query)
+                if score > best_score:
+                    best, best_score = s, score
+                    if score >= 1.0:
+                        break
+            return [best] if best is not None else []
+        
         scored = [(s, s.matches(query)) for s in self.scenarios]
         scored = [(s, score) for s, score in scored if score > 0]
         scored.sort(key=lambda x: x[1], reverse=True)
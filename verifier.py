@@ -539,6 +539,9 @@ def format_verification_report(result: VerificationResult) -> str:
 # 後方互換性関数
 # ========================================
 
+_default_verifier: Optional[LogVerifier] = None
+
+
 def verify_log_content(log_text: str) -> Dict[str, Any]:
     """
     後方互換性のためのラッパー関数
@@ -546,8 +549,11 @@ def verify_log_content(log_text: str) -> Dict[str, Any]:
     【非推奨】
     新しいコードでは LogVerifier を直接使用してください。
     """
-    verifier = LogVerifier(use_ai=False)
-    result = verifier.verify(log_text)
+    global _default_verifier
+    if _default_verifier is None:
+        # パターンのコンパイルは初回のみ
+        _default_verifier = LogVerifier(use_ai=False)
+    result = _default_verifier.verify(log_text)
     
     # 旧形式に変換
     return {